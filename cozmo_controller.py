@@ -27,12 +27,28 @@ NOT WORKING:
 import sys
 import time
 import argparse
+import bisect
+import collections
+import concurrent.futures
+import ctypes
+import ctypes.util
+import functools
+import hashlib
+import io
 import json
+import math
+import operator
 import os
+import queue
+import re
+import shlex
 import subprocess
+import tempfile
 import shutil
 import threading
-import uuid
+import traceback
+import wave
+import xml.etree.ElementTree as ET
 from pathlib import Path
 from typing import Optional, Dict, Any, List
 
@@ -40,41 +56,276 @@ try:
     import pycozmo
     import numpy as np
     from PIL import Image, ImageDraw, ImageFont
-    from pycozmo import protocol_encoder, lights, event, anim
+    from pycozmo import protocol_encoder, lights, event, anim, audio
     from pycozmo.expressions import Happiness, Sadness, Anger, Surprise, Neutral
 except ImportError as e:
     print(f"Error: pycozmo not installed. Run: pip install --user pycozmo")
     sys.exit(1)
 
+try:
+    from piper import PiperVoice
+except ImportError:
+    PiperVoice = None  # Optional neural TTS (pip install piper-tts)
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None  # Fall back to xml.etree for SoundbanksInfo.xml
+
 TTS_AVAILABLE = True
 ESPEAK_CMD = "/usr/bin/espeak"
+PIPER_MODEL = os.environ.get("COZMO_PIPER_MODEL", "")  # Piper .onnx voice; empty = use espeak
+TTS_CACHE_MAX_BYTES = 50 * 1024 * 1024  # Disk budget for cached TTS audio
+DRIVE_COALESCE_WINDOW = 0.005  # Wheel updates within this window collapse into one send
+TTS_SAMPLE_RATE = 22050  # espeak output: 16-bit mono at this rate
+WAV_HEADER_BYTES = 44
+AUDIO_TAIL_PAD = 0.1  # Extra wait after audio so the last frames are transmitted
+AUDIO_PKT_CACHE_SIZE = 32  # Encoded TTS clips kept in memory for replay
+AUDIO_QUEUE_SIZE = 32  # Pending async say/play-sound jobs before callers block
+AUDIO_WAIT_TIMEOUT = 120.0  # Longest wait-audio blocks on queued playback
+BATTERY_MIN_V = 3.5  # Cozmo Li-ion battery: 3.5V = 0%
+BATTERY_MAX_V = 4.2  # 4.2V = 100%
+BATTERY_CACHE_TTL = 2.0  # Seconds a polled battery voltage is reused
+SCREEN_FONT_PATH = '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf'
+
+
+def _require_connected(fn):
+    """Make a CozmoController method return False when not connected."""
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if not self.connected or self.cli is None:
+            return False
+        return fn(self, *args, **kwargs)
+    return wrapper
+
+
+def _spawn_and_wait(argv: list) -> tuple:
+    """Run argv to completion and return (returncode, stderr text).
+
+    Uses posix_spawn where available so the (large) interpreter process is
+    not forked for short-lived helpers like espeak.
+    """
+    if not hasattr(os, "posix_spawn"):
+        result = subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        return result.returncode, result.stderr
+
+    err_r, err_w = os.pipe()
+    try:
+        file_actions = [
+            (os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0),
+            (os.POSIX_SPAWN_DUP2, err_w, 2),
+            (os.POSIX_SPAWN_CLOSE, err_r),
+        ]
+        pid = os.posix_spawn(argv[0], argv, os.environ, file_actions=file_actions)
+    except OSError:
+        os.close(err_r)
+        raise
+    finally:
+        os.close(err_w)
+
+    with os.fdopen(err_r, "rb") as err:
+        stderr = err.read()
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status), stderr.decode(errors="replace")
+
+
+@functools.lru_cache(maxsize=16)
+def _get_font(path: str, size: int):
+    """Load a TrueType font once per (path, size); None if the file is missing."""
+    return ImageFont.truetype(path, size) if os.path.exists(path) else None
+
+
+@functools.lru_cache(maxsize=1)
+def _default_font():
+    """PIL's built-in font, loaded once."""
+    return ImageFont.load_default()
+
+
+@functools.lru_cache(maxsize=256)
+def _line_mask(text: str) -> Image:
+    """Screen-sized 1-bit mask of text in the default font, drawn at (0, 0).
+
+    Cached per string: battery readouts repeat a small set of values.
+    Whole lines are cached rather than single glyphs, because FreeType
+    places glyphs at fractional, kerned positions that per-glyph blits
+    cannot reproduce exactly.
+    """
+    mask = Image.new('1', (128, 32), color=0)
+    ImageDraw.Draw(mask).text((0, 0), text, fill=1, font=_default_font())
+    return mask
+
+
+def _render_line(canvas: Image, text: str, x: int, y: int):
+    """Draw text on canvas at (x, y) from the cached line masks."""
+    canvas.paste(1, (x, y), _line_mask(text))
+
+
+class EspeakLibrary:
+    """In-process speech synthesis through libespeak-ng.
+
+    Keeps the voice data loaded between utterances instead of starting an
+    espeak process for every call. Use EspeakLibrary.load() to get an
+    instance; it returns None when the library is not installed.
+    """
+
+    AUDIO_OUTPUT_SYNCHRONOUS = 2
+    POS_CHARACTER = 1
+    CHARS_UTF8 = 1
+    PARAM_RATE = 1
+    PARAM_VOLUME = 2
+    PARAM_PITCH = 3
+
+    _SYNTH_CALLBACK = ctypes.CFUNCTYPE(
+        ctypes.c_int, ctypes.POINTER(ctypes.c_short), ctypes.c_int, ctypes.c_void_p)
+
+    def __init__(self, lib: ctypes.CDLL):
+        self._lib = lib
+        self._lock = threading.Lock()
+        self._chunks: List[bytes] = []
+        self._params = None
+
+        lib.espeak_Initialize.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        lib.espeak_SetSynthCallback.argtypes = [self._SYNTH_CALLBACK]
+        lib.espeak_SetVoiceByName.argtypes = [ctypes.c_char_p]
+        lib.espeak_SetParameter.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        lib.espeak_Synth.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_uint, ctypes.c_int,
+                                     ctypes.c_uint, ctypes.c_uint, ctypes.c_void_p, ctypes.c_void_p]
+
+        self.sample_rate = lib.espeak_Initialize(self.AUDIO_OUTPUT_SYNCHRONOUS, 0, None, 0)
+        if self.sample_rate <= 0:
+            raise OSError("espeak_Initialize failed")
+
+        # Keep a reference so the callback isn't garbage collected
+        self._callback = self._SYNTH_CALLBACK(self._on_samples)
+        lib.espeak_SetSynthCallback(self._callback)
+
+    @classmethod
+    def load(cls) -> Optional["EspeakLibrary"]:
+        """Load libespeak-ng, or return None if it isn't available."""
+        name = ctypes.util.find_library("espeak-ng") or ctypes.util.find_library("espeak")
+        if not name:
+            return None
+        try:
+            return cls(ctypes.CDLL(name))
+        except (OSError, AttributeError) as e:
+            print(f"libespeak not usable, falling back to {ESPEAK_CMD}: {e}")
+            return None
+
+    def _on_samples(self, wav, numsamples, events):
+        if wav and numsamples > 0:
+            self._chunks.append(ctypes.string_at(wav, numsamples * 2))
+        return 0
+
+    def warm_up(self, voice: str = "en-us"):
+        """Load a voice and its dictionary ahead of the first utterance."""
+        with self._lock:
+            if self._lib.espeak_SetVoiceByName(voice.encode()) == 0:
+                self._params = None  # Parameters are re-applied on next synthesize
+                self._lib.espeak_Synth(b" ", 2, 0, self.POS_CHARACTER, 0,
+                                       self.CHARS_UTF8, None, None)
+            self._chunks = []
+
+    def synthesize(self, text: str, wav_path: Path, voice: str, speed: int,
+                   pitch: int, amplitude: int) -> bool:
+        """Synthesize text into a 16-bit mono WAV file. Returns False on failure."""
+        with self._lock:
+            params = (voice, speed, pitch, amplitude)
+            if params != self._params:
+                if self._lib.espeak_SetVoiceByName(voice.encode()) != 0:
+                    return False
+                self._lib.espeak_SetParameter(self.PARAM_RATE, speed, 0)
+                self._lib.espeak_SetParameter(self.PARAM_PITCH, pitch, 0)
+                self._lib.espeak_SetParameter(self.PARAM_VOLUME, amplitude, 0)
+                self._params = params
+
+            data = text.encode("utf-8")
+            self._chunks = []
+            err = self._lib.espeak_Synth(data, len(data) + 1, 0, self.POS_CHARACTER, 0,
+                                         self.CHARS_UTF8, None, None)
+            samples = b"".join(self._chunks)
+            self._chunks = []
+            if err != 0:
+                return False
+
+        with wave.open(str(wav_path), 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            w.writeframes(samples)
+        return True
 
 
 class CozmoController:
     """Controller class for Cozmo robot - FIXED based on testing."""
 
+    # Fixed attribute layout: cheaper attribute writes in per-packet handlers
+    __slots__ = (
+        'cli', 'connected', 'anims_loaded', 'battery_voltage', 'head_angle',
+        '_clip_metadata', '_animation_groups', '_pending_audio_time',
+        '_bg_pool', '_bg_futures', '_bg_futures_lock', '_bg_pool_lock',
+        '_cliff_enabled', '_cliff_reaction', '_cliff_detected',
+        '_pending_drive', '_drive_lock', '_drive_tick', '_drive_thread',
+        '_stop_event', '_anim_durations',
+        'tts_dir', 'tts_cache_max_bytes',
+        '_espeak_lib', '_espeak_lib_checked', '_piper', '_piper_checked',
+        '_tts_engine_lock', '_tts_warm_started',
+        '_audio_pkt_cache', '_audio_pkt_lock', '_sound_files', '_sound_names_lower',
+        '_soundbank_index', '_soundbank_mtime', '_soundbank_lock', '_wem_by_id',
+        '_audio_queue', '_audio_thread', '_audio_lock', '_audio_pending', '_audio_idle',
+        '_battery_cache',
+    )
+
     # Cliff reaction types
     CLIFF_REACTION_STOP = "stop"
     CLIFF_REACTION_BACKUP = "backup"
     CLIFF_REACTION_ANIMATE = "animate"
     CLIFF_REACTION_NONE = "none"
 
+    # Prebuilt wheel packets for the cliff reaction (see _get_stop_pkt)
+    _STOP_PKT = None
+    _BACKUP_PKT = None
+    _BATTERY_TEMPLATE = None  # Battery outline image, drawn once
+    _PCT_PER_VOLT = 100.0 / (BATTERY_MAX_V - BATTERY_MIN_V)
+    _SCREEN_CANVAS = None  # Reused 128x32 frame, guarded by _SCREEN_LOCK
+    _SCREEN_LOCK = threading.Lock()
+
+    # Backpack LED colors by name
+    _COLOR_MAP = {
+        "red": lights.red_light,
+        "green": lights.green_light,
+        "blue": lights.blue_light,
+        "white": lights.white_light,
+        "off": lights.off_light,
+    }
+
     def __init__(self, auto_connect: bool = True):
         self.cli: Optional[pycozmo.Client] = None
         self.connected = False
         self.anims_loaded = False
         self.battery_voltage = 0.0
+        self._battery_cache = (float('-inf'), 0.0)  # (monotonic time, voltage)
         self.head_angle = 0.0
         self._clip_metadata = {}
         self._animation_groups = {}
         self._pending_audio_time = 0.0
-        self._bg_threads: List[threading.Thread] = []
-        self._bg_lock = threading.Lock()
+        self._bg_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._bg_futures = collections.deque()  # Running futures; each removes itself when done
+        self._bg_futures_lock = threading.Lock()
+        self._bg_pool_lock = threading.Lock()  # Guards pool creation/shutdown only
 
         # Cliff detection settings
         self._cliff_enabled = True
         self._cliff_reaction = self.CLIFF_REACTION_BACKUP  # stop, backup, animate, none
         self._cliff_detected = False
+
+        # Latest-wins wheel command, sent by the drive sender thread
+        self._pending_drive: Optional[tuple] = None
+        self._drive_lock = threading.Lock()
+        self._drive_tick = threading.Event()
+        self._drive_thread: Optional[threading.Thread] = None
+
+        # Set to cut short audio waits when disconnecting without waiting
+        self._stop_event = threading.Event()
         
         # Animation duration cache
         self._anim_durations = {}  # Cache for animation durations
@@ -82,7 +333,27 @@ class CozmoController:
         # TTS audio directory
         self.tts_dir = Path.home() / ".cozmo" / "tts"
         self.tts_dir.mkdir(parents=True, exist_ok=True)
+        self.tts_cache_max_bytes = TTS_CACHE_MAX_BYTES
+        self._espeak_lib: Optional[EspeakLibrary] = None
+        self._espeak_lib_checked = False
+        self._piper = None
+        self._piper_checked = False
+        self._tts_engine_lock = threading.Lock()
+        self._tts_warm_started = False
+        self._audio_pkt_cache = collections.OrderedDict()  # WAV path -> encoded packets (LRU)
+        self._audio_pkt_lock = threading.Lock()
         self._sound_files = []  # Cache for sound file info
+        self._sound_names_lower = []  # Case-folded names, parallel to _sound_files
+        self._soundbank_index = None  # Lowercase ShortName -> (Id, ShortName, Path)
+        self._soundbank_mtime = None
+        self._soundbank_lock = threading.Lock()  # Serializes index builds
+        self._wem_by_id = None  # File Id -> .wem path anywhere under the sound dir
+        # Async audio runs one job at a time on a single worker (one audio channel)
+        self._audio_queue = queue.Queue(maxsize=AUDIO_QUEUE_SIZE)
+        self._audio_thread = None
+        self._audio_lock = threading.Lock()
+        self._audio_pending = 0  # Queued or playing jobs, for wait_for_audio
+        self._audio_idle = threading.Condition(self._audio_lock)
 
         if auto_connect:
             self.connect()
@@ -102,6 +373,10 @@ class CozmoController:
                 )
                 
                 self.cli.start()
+                # Load the TTS voice while the connection settles
+                if not self._tts_warm_started:
+                    self._tts_warm_started = True
+                    self._run_in_background(self._warm_up_tts)
                 self.cli.connect()
                 time.sleep(3)  # Wait for connection
 
@@ -136,7 +411,11 @@ class CozmoController:
                 if self._cliff_enabled:
                     self._setup_cliff_detection()
 
+                # Keep the TTS cache within its disk budget
+                self._evict_tts_cache()
+
                 self.connected = True
+                self._start_drive_sender()
                 print("✓ Connected to Cozmo!")
                 print(f"   Serial: {self.cli.serial_number}")
                 print(f"   Battery: {self.cli.battery_voltage:.2f}V")
@@ -146,7 +425,6 @@ class CozmoController:
                 
             except Exception as e:
                 print(f"✗ Connection failed: {e}")
-                import traceback
                 traceback.print_exc()
                 if attempt < retries - 1:
                     time.sleep(delay)
@@ -160,8 +438,11 @@ class CozmoController:
 
     def _on_robot_state(self, cli, pkt):
         """Handle robot state updates."""
-        self.battery_voltage = getattr(pkt, 'battery_voltage', self.battery_voltage)
-        self.head_angle = getattr(pkt, 'head_angle_rad', self.head_angle)
+        try:
+            self.battery_voltage = pkt.battery_voltage
+            self.head_angle = pkt.head_angle_rad
+        except AttributeError:
+            pass
     
     def _setup_cliff_detection(self):
         """Setup cliff detection handler and enable it."""
@@ -183,16 +464,31 @@ class CozmoController:
             # Execute reaction based on setting
             self._execute_cliff_reaction()
     
+    @classmethod
+    def _get_stop_pkt(cls):
+        """Shared DriveWheels(0, 0) packet, built on first use."""
+        if cls._STOP_PKT is None:
+            cls._STOP_PKT = protocol_encoder.DriveWheels(lwheel_speed_mmps=0, rwheel_speed_mmps=0)
+        return cls._STOP_PKT
+
+    @classmethod
+    def _get_backup_pkt(cls):
+        """Shared slow-reverse DriveWheels packet for the cliff reaction."""
+        if cls._BACKUP_PKT is None:
+            cls._BACKUP_PKT = protocol_encoder.DriveWheels(lwheel_speed_mmps=-50, rwheel_speed_mmps=-50)
+        return cls._BACKUP_PKT
+
     def _execute_cliff_reaction(self):
         """Execute the configured cliff reaction."""
         if self._cliff_reaction == self.CLIFF_REACTION_NONE:
             return
         
-        # Always stop motors first
-        try:
-            self.cli.stop_all_motors()
-        except:
-            pass
+        cli = self.cli
+        if cli is None:
+            return
+        
+        # Always stop motors first, dropping any queued wheel command
+        self._halt_wheels(cli)
         
         if self._cliff_reaction == self.CLIFF_REACTION_STOP:
             print("Cliff reaction: stopped")
@@ -200,10 +496,9 @@ class CozmoController:
         elif self._cliff_reaction == self.CLIFF_REACTION_BACKUP:
             print("Cliff reaction: backing up...")
             # Back up slowly
-            pkt = protocol_encoder.DriveWheels(lwheel_speed_mmps=-50, rwheel_speed_mmps=-50)
-            self.cli.conn.send(pkt)
+            cli.conn.send(self._get_backup_pkt())
             time.sleep(1.0)
-            self.cli.stop_all_motors()
+            cli.conn.send(self._get_stop_pkt())
             print("Cliff reaction: backed up")
         
         elif self._cliff_reaction == self.CLIFF_REACTION_ANIMATE:
@@ -211,10 +506,10 @@ class CozmoController:
             try:
                 if not self.anims_loaded:
                     self.load_animations()
-                self.cli.play_anim_group("ReactToCliff")
+                cli.play_anim_group("ReactToCliff")
                 time.sleep(2.0)
-            except:
-                pass
+            except (KeyError, ValueError, OSError) as e:
+                print(f"Cliff reaction animation failed: {e}")
     
     def set_cliff_reaction(self, reaction: str = "backup"):
         """Set what happens when a cliff is detected.
@@ -240,52 +535,233 @@ class CozmoController:
         self._cliff_detected = False
         return detected
 
-    def disconnect(self):
-        """Disconnect from Cozmo."""
-        # Wait for all background threads to complete
-        self._wait_for_bg_threads()
+    def disconnect(self, wait: bool = True):
+        """Disconnect from Cozmo.
         
-        if self.cli:
+        Args:
+            wait: If True, let background tasks (e.g. async audio) finish first.
+                  If False, cancel pending audio waits and disconnect promptly.
+        """
+        if not wait:
+            self._stop_event.set()
+        
+        # Let queued audio play out (or drain it when cancelling)
+        self._stop_audio_worker(timeout=30.0 if wait else 1.0)
+        
+        # Wait for all background tasks to complete
+        finished = self._wait_for_bg_threads(timeout=30.0 if wait else 1.0)
+        with self._bg_pool_lock:
+            pool, self._bg_pool = self._bg_pool, None
+        if pool:
+            # Don't block past the wait timeout on a stuck task
+            pool.shutdown(wait=finished, cancel_futures=False)
+        self._stop_drive_sender()
+        
+        if self.cli is not None:
             try:
                 self.cli.stop()
-            except:
-                pass
+            except RuntimeError as e:
+                # Client threads were never started (connection failed early)
+                print(f"Error stopping client: {e}")
         
         self.cli = None
         self.connected = False
+        self._battery_cache = (float('-inf'), 0.0)
+        self._stop_event.clear()
         print("Disconnected from Cozmo")
     
     def _run_in_background(self, func, *args, **kwargs):
-        """Run a function in a background thread."""
+        """Run a function on the background worker pool."""
         def wrapper():
             try:
                 func(*args, **kwargs)
             except Exception as e:
                 print(f"Background task error: {e}")
         
-        with self._bg_lock:
-            # Clean up finished threads
-            self._bg_threads = [t for t in self._bg_threads if t.is_alive()]
-            
-            thread = threading.Thread(target=wrapper, daemon=True)
-            self._bg_threads.append(thread)
-            thread.start()
-        return thread
+        pool = self._bg_pool
+        if pool is None:
+            with self._bg_pool_lock:
+                if self._bg_pool is None:
+                    self._bg_pool = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=4, thread_name_prefix="cozmo-bg")
+                pool = self._bg_pool
+        
+        future = pool.submit(wrapper)
+        with self._bg_futures_lock:
+            self._bg_futures.append(future)
+        # Finished futures drop out at once, so a long session doesn't keep them all
+        future.add_done_callback(self._forget_bg_future)
+        return future
+    
+    def _forget_bg_future(self, future):
+        """Done callback: remove a finished background future from the pending list."""
+        with self._bg_futures_lock:
+            try:
+                self._bg_futures.remove(future)
+            except ValueError:
+                pass  # Already removed
     
-    def _wait_for_bg_threads(self, timeout: float = 30.0):
-        """Wait for all background threads to complete."""
-        with self._bg_lock:
-            threads = list(self._bg_threads)
+    def _wait_for_bg_threads(self, timeout: float = 30.0) -> bool:
+        """Wait for all background tasks to complete.
         
-        if not threads:
-            return
+        Wakes as soon as the last task finishes rather than joining each in turn.
+        
+        Returns:
+            True if every task finished within the timeout
+        """
+        with self._bg_futures_lock:
+            futures = [f for f in self._bg_futures if not f.done()]
+        not_done = ()
         
-        print(f"Waiting for {len(threads)} background task(s)...")
-        for thread in threads:
-            thread.join(timeout=timeout)
+        if futures:
+            print(f"Waiting for {len(futures)} background task(s)...")
+            _, not_done = concurrent.futures.wait(
+                futures, timeout=timeout, return_when=concurrent.futures.ALL_COMPLETED)
+            if not_done:
+                print(f"Warning: {len(not_done)} background task(s) still running after {timeout:g}s")
         
-        with self._bg_lock:
-            self._bg_threads = [t for t in self._bg_threads if t.is_alive()]
+        return not not_done
+
+    def _queue_audio(self, job):
+        """Queue an audio job for the audio worker, starting it if needed.
+
+        Jobs run one at a time in submission order. Blocks if
+        AUDIO_QUEUE_SIZE jobs are already waiting.
+        """
+        # Queue first: a worker only exits once it finds the queue empty, so
+        # either the running worker takes this job or it has already cleared
+        # _audio_thread and a new one is started below
+        with self._audio_lock:
+            self._audio_pending += 1
+        self._audio_queue.put(job)
+        with self._audio_lock:
+            if self._audio_thread is None:
+                self._audio_thread = threading.Thread(
+                    target=self._audio_loop, name="cozmo-audio", daemon=True)
+                self._audio_thread.start()
+
+    def _audio_loop(self):
+        """Audio worker: run queued jobs until a None sentinel arrives."""
+        while True:
+            job = self._audio_queue.get()
+            if job is None:
+                with self._audio_lock:
+                    # Jobs queued after the stop request keep the worker going
+                    if self._audio_queue.empty():
+                        self._audio_thread = None
+                        return
+                continue
+            try:
+                # On disconnect(wait=False), drop whatever is still queued
+                if not self._stop_event.is_set():
+                    job()
+            except Exception as e:
+                print(f"Audio job failed: {e}")
+            finally:
+                with self._audio_idle:
+                    self._audio_pending -= 1
+                    if not self._audio_pending:
+                        self._audio_idle.notify_all()
+
+    def _stop_audio_worker(self, timeout: float):
+        """Let the audio worker finish its queue, then stop it.
+
+        The worker clears _audio_thread itself when it exits. If the join
+        times out, the reference stays, so no second worker is started
+        while this one is still playing.
+        """
+        with self._audio_lock:
+            thread = self._audio_thread
+        if thread is None:
+            return
+        # The queue is bounded, so the sentinel waits for a free slot within the timeout too
+        deadline = time.monotonic() + timeout
+        try:
+            self._audio_queue.put(None, timeout=timeout)
+        except queue.Full:
+            print(f"Warning: audio queue still full after {timeout:g}s")
+            return
+        thread.join(max(0.0, deadline - time.monotonic()))
+        if thread.is_alive():
+            print(f"Warning: audio still playing after {timeout:g}s")
+
+    def wait_for_audio(self, timeout: float = AUDIO_WAIT_TIMEOUT):
+        """Block until all queued async audio has finished playing.
+
+        Returns:
+            True if every queued job finished within timeout seconds
+        """
+        with self._audio_idle:
+            finished = self._audio_idle.wait_for(lambda: not self._audio_pending, timeout)
+        if not finished:
+            print(f"Warning: audio still playing after {timeout:g}s")
+        return finished
+
+    def _start_drive_sender(self):
+        """Start the thread that sends coalesced DriveWheels packets."""
+        if self._drive_thread and self._drive_thread.is_alive():
+            return
+        self._drive_thread = threading.Thread(
+            target=self._drive_sender_loop, name="cozmo-drive", daemon=True)
+        self._drive_thread.start()
+
+    def _stop_drive_sender(self):
+        """Stop the drive sender thread, discarding any unsent command."""
+        thread, self._drive_thread = self._drive_thread, None
+        if thread:
+            self._cancel_pending_drive()
+            self._drive_tick.set()
+            thread.join(timeout=1.0)
+
+    def _drive_sender_loop(self):
+        """Send the most recent wheel command, collapsing bursts of updates."""
+        me = threading.current_thread()
+        while self._drive_thread is me:
+            self._drive_tick.wait()
+            self._drive_tick.clear()
+            # Send under the lock so a stop can't slip in between taking the
+            # command and sending it, which would restart the wheels
+            with self._drive_lock:
+                pending, self._pending_drive = self._pending_drive, None
+                cli = self.cli
+                if pending is None or cli is None:
+                    continue
+                try:
+                    cli.conn.send(protocol_encoder.DriveWheels(
+                        lwheel_speed_mmps=pending[0],
+                        rwheel_speed_mmps=pending[1]
+                    ))
+                except Exception as e:
+                    print(f"Error driving wheels: {e}")
+            # Let further updates pile up; only the latest is sent
+            time.sleep(DRIVE_COALESCE_WINDOW)
+
+    def _queue_drive(self, left_speed: float, right_speed: float):
+        """Queue a wheel command for the sender thread (latest wins)."""
+        if self._drive_thread is None:
+            self.cli.conn.send(protocol_encoder.DriveWheels(
+                lwheel_speed_mmps=left_speed,
+                rwheel_speed_mmps=right_speed
+            ))
+            return
+        with self._drive_lock:
+            self._pending_drive = (left_speed, right_speed)
+        self._drive_tick.set()
+
+    def _cancel_pending_drive(self):
+        """Drop a queued wheel command so it can't be sent after a stop."""
+        with self._drive_lock:
+            self._pending_drive = None
+
+    def _halt_wheels(self, cli):
+        """Drop any queued wheel command and stop all motors.
+
+        Holds the drive lock across the stop, so the sender thread can't
+        send a stale command after it.
+        """
+        with self._drive_lock:
+            self._pending_drive = None
+            cli.stop_all_motors()
 
     def is_connected(self) -> bool:
         """Check if actually connected to robot (not just flag set).
@@ -421,15 +897,13 @@ class CozmoController:
         except Exception as e:
             return 2.0  # Default duration on error
 
+    @_require_connected
     def set_volume(self, level: int = 65535):
         """Set robot volume level.
 
         Args:
             level: Volume 0-65535 (0=silent, 65535=max)
         """
-        if not self.connected:
-            return False
-
         try:
             level = max(0, min(65535, level))
             self.cli.conn.send(protocol_encoder.SetRobotVolume(level=level))
@@ -439,6 +913,134 @@ class CozmoController:
             print(f"Error setting volume: {e}")
             return False
 
+    def _get_espeak_lib(self) -> Optional[EspeakLibrary]:
+        """Return the shared libespeak synthesizer, loading it on first use."""
+        with self._tts_engine_lock:
+            if not self._espeak_lib_checked:
+                self._espeak_lib = EspeakLibrary.load()
+                self._espeak_lib_checked = True
+        return self._espeak_lib
+
+    def _get_piper(self):
+        """Return the Piper voice from COZMO_PIPER_MODEL, or None to use espeak."""
+        with self._tts_engine_lock:
+            if not self._piper_checked:
+                self._piper_checked = True
+                if PiperVoice is not None and PIPER_MODEL:
+                    try:
+                        piper = PiperVoice.load(PIPER_MODEL)
+                        # pycozmo and the duration math expect 22050 Hz audio
+                        if piper.config.sample_rate == TTS_SAMPLE_RATE:
+                            self._piper = piper
+                        else:
+                            print(f"Piper model must be {TTS_SAMPLE_RATE} Hz, using espeak")
+                    except Exception as e:
+                        print(f"Error loading Piper model {PIPER_MODEL}: {e}")
+        return self._piper
+
+    def _warm_up_tts(self):
+        """Pay the TTS model/dictionary load cost before the first say."""
+        if self._get_piper() is not None:
+            return
+        espeak_lib = self._get_espeak_lib()
+        if espeak_lib is not None:
+            espeak_lib.warm_up()
+        elif os.path.exists(ESPEAK_CMD):
+            # Pulls the espeak binary and voice data into the page cache
+            subprocess.run([ESPEAK_CMD, "-v", "en-us", "-w", os.devnull, ""],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def _play_wav(self, wav_path: Path, cache: bool = False):
+        """Queue a WAV file for playback on the robot.
+        
+        With cache=True the u-law encoded packets are kept in memory, so
+        replaying the same file skips reading and re-encoding it.
+        """
+        key = str(wav_path)
+        pkts = None
+        if cache:
+            with self._audio_pkt_lock:
+                pkts = self._audio_pkt_cache.get(key)
+                if pkts is not None:
+                    self._audio_pkt_cache.move_to_end(key)
+        
+        if pkts is None:
+            pkts = audio.load_wav(key)
+            if cache:
+                with self._audio_pkt_lock:
+                    self._audio_pkt_cache[key] = pkts
+                    while len(self._audio_pkt_cache) > AUDIO_PKT_CACHE_SIZE:
+                        self._audio_pkt_cache.popitem(last=False)
+        
+        anim_controller = getattr(self.cli, 'anim_controller', None)
+        if anim_controller is not None:
+            anim_controller.play_audio(pkts)
+        else:
+            self.cli.play_audio(key)
+
+    def _cache_temp_path(self, stem: str) -> Path:
+        """Create a unique empty .wav in tts_dir for a file being generated.
+
+        Output is written there and os.replace()d into its cache name, so
+        readers never see a half-written file. The temp must live in the
+        same directory (not e.g. /dev/shm) for the rename to be atomic.
+        """
+        fd, path = tempfile.mkstemp(prefix=f"{stem}.", suffix=".wav", dir=self.tts_dir)
+        os.close(fd)
+        return Path(path)
+
+    def _play_and_wait(self, play, duration: float):
+        """Start audio with play() and block until the robot has played it.
+
+        Returns on pycozmo's EvtAudioCompleted, on disconnect(wait=False), or
+        after duration + AUDIO_TAIL_PAD if the event never arrives.
+        """
+        cli = self.cli
+        done = threading.Event()
+        handler = cli.add_handler(event.EvtAudioCompleted, lambda cli: done.set(), one_shot=True)
+        try:
+            play()
+            deadline = time.monotonic() + duration + AUDIO_TAIL_PAD
+            while not done.wait(0.05):
+                if self._stop_event.is_set() or time.monotonic() >= deadline:
+                    break
+        finally:
+            cli.del_handler(event.EvtAudioCompleted, handler)
+
+    @staticmethod
+    def _tts_duration(file_size: int) -> float:
+        """Audio length in seconds of a TTS WAV file of the given size."""
+        return max(0, file_size - WAV_HEADER_BYTES) / (TTS_SAMPLE_RATE * 2)
+
+    def _evict_tts_cache(self):
+        """Trim the TTS cache directory to its byte budget.
+
+        Least recently used files (by access time) are removed first.
+        """
+        try:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.tts_dir):
+                if entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_atime, st.st_size, entry.path))
+                    total += st.st_size
+
+            if total <= self.tts_cache_max_bytes:
+                return
+
+            entries.sort()
+            removed = 0
+            for _, size, path in entries:
+                if total <= self.tts_cache_max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+                removed += 1
+            print(f"TTS cache: evicted {removed} file(s)")
+        except OSError as e:
+            print(f"Error trimming TTS cache: {e}")
+
     def say_text(self, text: str, volume: int = 65535, voice: str = "en-us",
                  speed: int = 150, pitch: int = 50, amplitude: int = 100, 
                  async_mode: bool = False, effect: str = "normal") -> bool:
@@ -460,88 +1062,144 @@ class CozmoController:
             print("Not connected to Cozmo")
             return False
 
+        # Nothing to say: skip synthesis, the volume change and the waits
+        if not text or not text.strip():
+            return True
+
         def _play():
+            temp_paths = []
             try:
-                # Use counter + timestamp for unique filenames
-                import uuid
-                base_name = f"speech_{int(time.time())}_{uuid.uuid4().hex[:8]}"
-                wav_path = self.tts_dir / f"{base_name}.wav"
-                processed_path = self.tts_dir / f"{base_name}_processed.wav"
-
                 speed_val = max(80, min(450, speed))
                 pitch_val = max(0, min(99, pitch))
                 amp_val = max(0, min(200, amplitude))
 
-                # Generate base TTS with espeak
-                cmd = [
-                    ESPEAK_CMD,
-                    "-v", voice,
-                    "-s", str(speed_val),
-                    "-p", str(pitch_val),
-                    "-a", str(amp_val),
-                    "-w", str(wav_path),
-                    text
-                ]
-
-                result = subprocess.run(cmd, capture_output=True, text=True)
-
-                if result.returncode != 0:
-                    print(f"Error generating TTS: {result.stderr}")
-                    return
+                # Piper, when configured, has its own voice; the espeak options don't apply
+                piper = self._get_piper()
+                if piper is not None:
+                    voice_params = f"piper={Path(PIPER_MODEL).stem}"
+                else:
+                    voice_params = f"{voice}|{speed_val}|{pitch_val}|{amp_val}"
+                voice_desc = voice_params if piper is not None else f"voice={voice}, speed={speed_val}, pitch={pitch_val}"
+
+                # Cache generated audio by normalized text + voice parameters.
+                # Case is kept: espeak spells out all-caps words like "USB".
+                norm_text = " ".join(text.split())
+                key = hashlib.blake2b(
+                    f"{norm_text}|{voice_params}|{effect.lower()}".encode(), digest_size=16
+                ).hexdigest()
+                wav_path = self.tts_dir / f"{key}.wav"
+                effect_str = f" ({effect})" if effect.lower() != "normal" else ""
 
-                if not wav_path.exists():
-                    print(f"Error: WAV file not created: {wav_path}")
-                    return
+                # One stat answers both "is it cached?" and "how long is it?"
+                try:
+                    file_size = os.stat(wav_path).st_size
+                    final_path = wav_path
+                except FileNotFoundError:
+                    final_path = None
 
-                # Apply effect using sox if requested
-                final_path = wav_path
-                if effect.lower() == "cozmo":
-                    # Cozmo-like effect: pitch up + speed up for robot voice
-                    sox_cmd = [
-                        "sox", str(wav_path), str(processed_path),
-                        "pitch", "600",           # Pitch up (600 cents = 6 semitones)
-                        "speed", "1.1",           # Speed up 10%
-                        "gain", "2",              # Slight volume boost
-                        "contrast", "30"          # Enhance contrast
-                    ]
-                    
-                    result = subprocess.run(sox_cmd, capture_output=True, text=True)
-                    
-                    if result.returncode == 0 and processed_path.exists():
-                        final_path = processed_path
-                        wav_path.unlink()  # Clean up original
-                        print(f"Applied cozmo voice effect")
+                if final_path is not None:
+                    print(f"Using cached audio ({voice_desc}){effect_str}")
+                else:
+                    # Generate under per-call temp names and rename into place, so
+                    # concurrent says of the same text never see a half-written file
+                    raw_path = self._cache_temp_path(f"{key}_raw")
+                    temp_paths.append(raw_path)
+
+                    # Generate base TTS: Piper if configured, else espeak
+                    # (in-process when libespeak is available)
+                    espeak_lib = None if piper is not None else self._get_espeak_lib()
+                    if piper is not None:
+                        with wave.open(str(raw_path), 'wb') as w:
+                            if hasattr(piper, 'synthesize_wav'):
+                                piper.synthesize_wav(text, w)  # piper-tts >= 1.3
+                            else:
+                                piper.synthesize(text, w)
+                    elif espeak_lib is None or not espeak_lib.synthesize(
+                            text, raw_path, voice, speed_val, pitch_val, amp_val):
+                        cmd = [
+                            ESPEAK_CMD,
+                            "-v", voice,
+                            "-s", str(speed_val),
+                            "-p", str(pitch_val),
+                            "-a", str(amp_val),
+                            "-w", str(raw_path),
+                            text
+                        ]
+
+                        returncode, stderr = _spawn_and_wait(cmd)
+
+                        if returncode != 0:
+                            print(f"Error generating TTS: {stderr}")
+                            return
+
+                    file_size = os.stat(raw_path).st_size
+                    if file_size <= WAV_HEADER_BYTES:
+                        print(f"Error: WAV file not created: {raw_path}")
+                        return
+
+                    # Apply effect using sox if requested
+                    if effect.lower() == "cozmo":
+                        # Cozmo-like effect: pitch up + speed up for robot voice
+                        fx_path = self._cache_temp_path(key)
+                        temp_paths.append(fx_path)
+                        sox_cmd = [
+                            "sox", str(raw_path), str(fx_path),
+                            "pitch", "600",           # Pitch up (600 cents = 6 semitones)
+                            "speed", "1.1",           # Speed up 10%
+                            "gain", "2",              # Slight volume boost
+                            "contrast", "30"          # Enhance contrast
+                        ]
+
+                        result = subprocess.run(sox_cmd, stdout=subprocess.DEVNULL,
+                                                stderr=subprocess.PIPE, text=True)
+
+                        fx_size = os.stat(fx_path).st_size if result.returncode == 0 else 0
+
+                        if fx_size > WAV_HEADER_BYTES:
+                            os.replace(fx_path, wav_path)
+                            file_size = fx_size
+                            final_path = wav_path
+                            print(f"Applied cozmo voice effect")
+                        else:
+                            # Play the plain voice from the temp, which is deleted
+                            # afterwards; nothing is cached, so sox is retried next time
+                            final_path = raw_path
+                            print(f"Sox effect failed, using normal voice: {result.stderr}")
                     else:
-                        print(f"Sox effect failed, using normal voice: {result.stderr}")
+                        os.replace(raw_path, wav_path)
+                        final_path = wav_path
+
+                    print(f"Generated audio: {file_size} bytes ({voice_desc}){effect_str}")
+
+                # The TTS engines write plain 16-bit mono PCM, so the size gives the length
+                duration = self._tts_duration(file_size)
 
                 self.set_volume(volume)
                 time.sleep(0.2)
 
-                file_size = final_path.stat().st_size
-                effect_str = f" ({effect})" if effect.lower() != "normal" else ""
-                print(f"Generated audio: {file_size} bytes (voice={voice}, speed={speed_val}, pitch={pitch_val}){effect_str}")
-
-                import wave
-                with wave.open(str(final_path), 'r') as w:
-                    duration = w.getnframes() / w.getframerate()
-                
-                self.cli.play_audio(str(final_path))
                 print(f"Saying: {text}")
                 print(f"Audio duration: {duration:.1f}s")
-                time.sleep(duration + 0.5)
+                self._play_and_wait(lambda: self._play_wav(final_path, cache=final_path == wav_path),
+                                    duration)
 
             except Exception as e:
                 print(f"Error in TTS: {e}")
+            finally:
+                # Drop temps that were not renamed into the cache
+                for path in temp_paths:
+                    if path.exists():
+                        path.unlink()
 
         if async_mode:
             print(f"Saying (async): {text}")
-            self._run_in_background(_play)
+            self._queue_audio(_play)
             return True
         else:
             _play()
             return True
             return False
 
+    @_require_connected
     def set_head_angle(self, angle: float = 0.17, async_mode: bool = False):
         """Set Cozmo's head angle.
         
@@ -550,9 +1208,6 @@ class CozmoController:
                   -0.44 = looking down, 0.78 = looking up, 0.17 = middle
             async_mode: If True, return immediately
         """
-        if not self.connected:
-            return False
-
         try:
             angle = max(-0.44, min(0.78, angle))
             self.cli.set_head_angle(angle)
@@ -563,6 +1218,7 @@ class CozmoController:
             print(f"Error setting head angle: {e}")
             return False
 
+    @_require_connected
     def move_lift(self, speed: float = 0.5, duration: float = 1.0, async_mode: bool = False):
         """Move Cozmo's lift with speed control.
         
@@ -574,9 +1230,6 @@ class CozmoController:
             duration: How long to move (seconds)
             async_mode: If True, return immediately (NOTE: lift won't stop!)
         """
-        if not self.connected:
-            return False
-
         try:
             pkt = protocol_encoder.MoveLift(speed_rad_per_sec=speed)
             self.cli.conn.send(pkt)
@@ -588,6 +1241,7 @@ class CozmoController:
             print(f"Error moving lift: {e}")
             return False
 
+    @_require_connected
     def drive_wheels(self, left_speed: float, right_speed: float, duration: float = 1.0, async_mode: bool = False):
         """Drive Cozmo's wheels.
         
@@ -597,18 +1251,11 @@ class CozmoController:
             duration: How long to drive (seconds)
             async_mode: If True, return immediately (NOTE: wheels won't stop!)
         """
-        if not self.connected:
-            return False
-
         try:
-            pkt = protocol_encoder.DriveWheels(
-                lwheel_speed_mmps=left_speed,
-                rwheel_speed_mmps=right_speed
-            )
-            self.cli.conn.send(pkt)
+            self._queue_drive(left_speed, right_speed)
             if not async_mode:
                 time.sleep(duration)
-                self.cli.stop_all_motors()
+                self._halt_wheels(self.cli)
             return True
         except Exception as e:
             print(f"Error driving wheels: {e}")
@@ -625,6 +1272,7 @@ class CozmoController:
         duration = distance_mm / speed_mmps
         return self.drive_wheels(-speed_mmps, -speed_mmps, duration, async_mode)
 
+    @_require_connected
     def turn_in_place(self, angle_degrees: float = 90, async_mode: bool = False):
         """Turn Cozmo in place.
         
@@ -632,9 +1280,6 @@ class CozmoController:
             angle_degrees: Angle to turn (positive = left, negative = right)
             async_mode: If True, return immediately (NOTE: wheels won't stop!)
         """
-        if not self.connected:
-            return False
-
         try:
             duration = abs(angle_degrees) / 90.0  # ~1 second per 90 degrees
             speed = 100
@@ -668,30 +1313,24 @@ class CozmoController:
             print(f"Error turning: {e}")
             return False
 
+    @_require_connected
     def set_backpack_lights(self, color: str = "blue"):
         """Set backpack LED color.
 
         Available colors: red, green, blue, white, off
         """
-        if not self.connected:
-            return False
-
         try:
-            color_map = {
-                "red": lights.red_light,
-                "green": lights.green_light,
-                "blue": lights.blue_light,
-                "white": lights.white_light,
-                "off": lights.off_light,
-            }
-
-            light = color_map.get(color.lower(), lights.blue_light)
+            # Names usually arrive lowercase already; only fold case on a miss
+            light = self._COLOR_MAP.get(color)
+            if light is None:
+                light = self._COLOR_MAP.get(color.lower(), lights.blue_light)
             self.cli.set_all_backpack_lights(light)
             return True
         except Exception as e:
             print(f"Error setting lights: {e}")
             return False
 
+    @_require_connected
     def set_backpack_lights_individual(self, colors: list):
         """Set individual backpack LED colors.
 
@@ -699,38 +1338,28 @@ class CozmoController:
             colors: List of 5 colors for [left, front, middle, back, right]
                    Available: red, green, blue, white, off
         """
-        if not self.connected:
-            return False
-
         try:
-            color_map = {
-                "red": lights.red_light,
-                "green": lights.green_light,
-                "blue": lights.blue_light,
-                "white": lights.white_light,
-                "off": lights.off_light,
-            }
-
             if len(colors) != 5:
                 print("Error: Must provide exactly 5 colors")
                 return False
 
-            light_list = [color_map.get(c.lower(), lights.off_light) for c in colors]
+            color_map = self._COLOR_MAP
+            off = lights.off_light
+            light_list = [color_map[c] if c in color_map else color_map.get(c.lower(), off)
+                          for c in colors]
             self.cli.set_backpack_lights(light_list)
             return True
         except Exception as e:
             print(f"Error setting individual lights: {e}")
             return False
 
+    @_require_connected
     def set_head_light(self, enable: bool = True):
         """Enable/disable IR head light for night vision.
 
         Args:
             enable: True to turn on IR LED, False to turn off
         """
-        if not self.connected:
-            return False
-
         try:
             self.cli.set_head_light(enable)
             status = "on" if enable else "off"
@@ -740,14 +1369,12 @@ class CozmoController:
             print(f"Error setting head light: {e}")
             return False
 
+    @_require_connected
     def enable_cliff_detection(self, enable: bool = True):
         """Enable/disable automatic stop on cliff detection.
 
         Prevents robot from falling off edges.
         """
-        if not self.connected:
-            return False
-
         try:
             self._cliff_enabled = enable
             pkt = protocol_encoder.EnableStopOnCliff(enable=enable)
@@ -759,6 +1386,7 @@ class CozmoController:
             print(f"Error setting cliff detection: {e}")
             return False
 
+    @_require_connected
     def turn_to_angle(self, angle_rad: float, speed_rad_per_sec: float = 3.0,
                       accel_rad_per_sec2: float = 10.0, tolerance_rad: float = 0.05, async_mode: bool = False):
         """Turn robot to a specific angle with precision.
@@ -772,9 +1400,6 @@ class CozmoController:
             tolerance_rad: Angle tolerance for completion (default: 0.05 = ~3 degrees)
             async_mode: If True, return immediately
         """
-        if not self.connected:
-            return False
-
         try:
             pkt = protocol_encoder.TurnInPlace(
                 angle_rad=angle_rad,
@@ -792,6 +1417,7 @@ class CozmoController:
             print(f"Error turning to angle: {e}")
             return False
 
+    @_require_connected
     def calibrate_motors(self, head: bool = True, lift: bool = True):
         """Calibrate head and/or lift motors.
 
@@ -802,9 +1428,6 @@ class CozmoController:
             head: Calibrate head motor
             lift: Calibrate lift motor
         """
-        if not self.connected:
-            return False
-
         try:
             pkt = protocol_encoder.StartMotorCalibration(head=head, lift=lift)
             self.cli.conn.send(pkt)
@@ -816,6 +1439,7 @@ class CozmoController:
             print(f"Error calibrating motors: {e}")
             return False
 
+    @_require_connected
     def go_to_pose(self, x_mm: float, y_mm: float, angle_rad: float = 0.0):
         """Navigate to a specific pose (position and orientation).
 
@@ -824,9 +1448,6 @@ class CozmoController:
             y_mm: Target Y position in millimeters
             angle_rad: Target angle in radians (default: 0)
         """
-        if not self.connected:
-            return False
-
         try:
             self.cli.go_to_pose(x_mm, y_mm, angle_rad)
             return True
@@ -834,11 +1455,9 @@ class CozmoController:
             print(f"Error going to pose: {e}")
             return False
 
+    @_require_connected
     def wait_for_robot(self):
         """Wait for robot to be ready and stable."""
-        if not self.connected:
-            return False
-
         try:
             self.cli.wait_for_robot()
             return True
@@ -846,6 +1465,7 @@ class CozmoController:
             print(f"Error waiting for robot: {e}")
             return False
 
+    @_require_connected
     def play_anim_group(self, group_name: str = "CodeLabBored", async_mode: bool = False, wait: float = None):
         """Play an animation group (plays a random animation from the group).
 
@@ -855,9 +1475,6 @@ class CozmoController:
             async_mode: If True, run in background thread
             wait: Seconds to wait for animation (None=auto-compute from file, 0=no wait, >0=specified wait)
         """
-        if not self.connected:
-            return False
-
         # Auto-compute duration if not specified
         if wait is None:
             wait = self.get_anim_group_duration(group_name)
@@ -881,6 +1498,7 @@ class CozmoController:
             _play()
         return True
 
+    @_require_connected
     def play_animation(self, anim_name: str = "anim_bored_01", async_mode: bool = False, wait: float = None):
         """Play an animation.
         
@@ -889,9 +1507,6 @@ class CozmoController:
             async_mode: If True, run in background thread
             wait: Seconds to wait for animation (None=auto-compute from file, 0=no wait, >0=specified wait)
         """
-        if not self.connected:
-            return False
-
         # Auto-compute duration if not specified
         if wait is None:
             wait = self.get_animation_duration(anim_name)
@@ -923,8 +1538,8 @@ class CozmoController:
             show_duration: If True, compute and display animation duration
         """
         try:
-            # Load animation metadata if not loaded
-            if not self.anims_loaded:
+            # Load animation metadata if not cached
+            if not self._clip_metadata:
                 pycozmo.util.check_assets()
                 anim_dir = str(pycozmo.util.get_cozmo_anim_dir())
                 self._clip_metadata = pycozmo.anim_encoder.get_clip_metadata(anim_dir)
@@ -959,8 +1574,8 @@ class CozmoController:
             show_duration: If True, compute and display average group duration
         """
         try:
-            # Load animation groups if not loaded
-            if not self.anims_loaded:
+            # Load animation groups if not cached
+            if not self._animation_groups:
                 pycozmo.util.check_assets()
                 resource_dir = str(pycozmo.util.get_cozmo_asset_dir())
                 self._animation_groups = pycozmo.anim.load_animation_groups(resource_dir)
@@ -988,44 +1603,169 @@ class CozmoController:
             print(f"Error listing animation groups: {e}")
             return False
 
+    def _load_soundbank_index(self) -> dict:
+        """Parse SoundbanksInfo.xml once and cache the sound tables.
+
+        Builds the sorted sound list used by list_sounds, a lookup of
+        lowercase ShortName -> (Id, ShortName, Path) used by play_sound and
+        a File Id -> .wem path map. All are rebuilt only when the file's
+        mtime changes. Concurrent callers wait for a single build.
+
+        Returns:
+            The ShortName index (empty if the sound info is missing)
+        """
+        sound_dir = pycozmo.util.get_cozmo_asset_dir() / "cozmo_resources" / "sound"
+        info_path = sound_dir / "SoundbanksInfo.xml"
+
+        try:
+            mtime = os.stat(info_path).st_mtime
+        except FileNotFoundError:
+            print(f"Sound info not found: {info_path}")
+            return {}
+        if self._soundbank_index is not None and mtime == self._soundbank_mtime:
+            return self._soundbank_index
+
+        with self._soundbank_lock:
+            # Another thread may have finished the build while we waited
+            if self._soundbank_index is not None and mtime == self._soundbank_mtime:
+                return self._soundbank_index
+
+            # Scan the sound tree for .wem files while the XML is being parsed
+            wem_by_id = {}
+            wem_thread = threading.Thread(
+                target=lambda: wem_by_id.update(self._scan_wem_files(sound_dir)),
+                name="cozmo-wem", daemon=True)
+            wem_thread.start()
+
+            sounds, index, _ = self._scan_soundbank(info_path)
+            wem_thread.join()
+            self._wem_by_id = wem_by_id
+            self._store_soundbank(sounds, index, mtime)
+            return index
+
+    @staticmethod
+    def _scan_soundbank(info_path: Path, needle: str = None) -> tuple:
+        """Parse the File entries of SoundbanksInfo.xml into the sound tables.
+
+        With needle, stops at the first exact (lowercase) ShortName match.
+
+        Returns:
+            (sounds, index, complete): the unsorted sound list, the lowercase
+            ShortName -> (Id, ShortName, Path) index in document order, and
+            whether the whole file was read
+        """
+        if lxml_etree is not None:
+            # Stream File elements without building the whole tree
+            file_elems = (elem for _, elem in lxml_etree.iterparse(str(info_path), tag='File'))
+        else:
+            file_elems = (elem for _, elem in ET.iterparse(str(info_path))
+                          if elem.tag == 'File')
+
+        sounds = []
+        index = {}
+        for file_elem in file_elems:
+            file_id = file_elem.get('Id', '')
+            short_name = file_elem.findtext('ShortName', '')
+            lower = short_name.lower()
+            sounds.append({
+                'id': int(file_id) if file_id else 0,
+                'name': short_name,
+                'language': file_elem.get('Language', 'SFX')
+            })
+            # First entry wins, matching the document-order search
+            index.setdefault(lower, (file_id, short_name, file_elem.findtext('Path', '')))
+            file_elem.clear()
+            if lower == needle:
+                return sounds, index, False
+        return sounds, index, True
+
+    @staticmethod
+    def _scan_wem_files(sound_dir: Path) -> dict:
+        """Map File Id -> .wem path for every .wem file under sound_dir."""
+        return {p.stem: p for p in sound_dir.rglob('*.wem')}
+
+    def _store_soundbank(self, sounds: list, index: dict, mtime: float):
+        """Install fully parsed sound tables (caller holds _soundbank_lock)."""
+        # Sort case-insensitively so prefix searches can bisect the lowercase names
+        sounds.sort(key=lambda x: x['name'].lower())
+        self._sound_names_lower = [s['name'].lower() for s in sounds]
+        self._sound_files = sounds
+        self._soundbank_index = index
+        self._soundbank_mtime = mtime
+
+    def _find_cold_sound(self, sound_dir: Path, needle: str) -> Optional[tuple]:
+        """Look up one sound before the index exists, parsing only as far as needed.
+
+        Stops at an exact match and builds the full index in the background.
+        If the whole file had to be read anyway, the parsed tables become the
+        index directly instead of parsing the file a second time.
+
+        Returns:
+            (Id, ShortName, Path), or None if missing or not found
+        """
+        info_path = sound_dir / "SoundbanksInfo.xml"
+        try:
+            mtime = os.stat(info_path).st_mtime
+            sounds, index, complete = self._scan_soundbank(info_path, needle)
+        except OSError:
+            print(f"Sound info not found: {info_path}")
+            return None
+
+        if complete:
+            with self._soundbank_lock:
+                if self._soundbank_index is None:
+                    self._store_soundbank(sounds, index, mtime)
+        else:
+            self._run_in_background(self._load_soundbank_index)
+
+        # Exact name first, then the first name containing it
+        return index.get(needle) or next(
+            (v for k, v in index.items() if needle in k), None)
+
+    def _load_sound_files(self) -> list:
+        """Return the cached sound list, sorted by name.
+
+        Returns:
+            List of dicts with 'id', 'name' and 'language' keys
+        """
+        if not self._load_soundbank_index():
+            return []
+        return self._sound_files
+
+    def search_sound(self, prefix: str) -> list:
+        """Return the sounds whose name starts with prefix (case-insensitive).
+
+        Uses binary search over the sorted name index instead of a linear scan.
+        """
+        sounds = self._load_sound_files()
+        names = self._sound_names_lower
+        prefix = prefix.lower()
+        start = bisect.bisect_left(names, prefix)
+        end = start
+        while end < len(names) and names[end].startswith(prefix):
+            end += 1
+        return sounds[start:end]
+
     def list_sounds(self, search: str = None):
         """List available sounds from assets.
         
         Args:
-            search: Optional filter string to search sound names
+            search: Optional filter string to search sound names (or ids);
+                    a trailing '*' matches name prefixes instead, e.g. 'meow*'
         """
         try:
-            import xml.etree.ElementTree as ET
-            
-            # Load sound info from SoundbanksInfo.xml
-            sound_dir = pycozmo.util.get_cozmo_asset_dir() / "cozmo_resources" / "sound"
-            info_path = sound_dir / "SoundbanksInfo.xml"
-            
-            if not info_path.exists():
-                print(f"Sound info not found: {info_path}")
+            sounds = self._load_sound_files()
+            if not sounds:
                 return False
             
-            # Parse XML
-            tree = ET.parse(info_path)
-            root = tree.getroot()
-            
-            sounds = []
-            for file_elem in root.findall('.//File'):
-                file_id = file_elem.get('Id')
-                short_name = file_elem.findtext('ShortName', '')
-                language = file_elem.get('Language', 'SFX')
-                sounds.append({
-                    'id': int(file_id) if file_id else 0,
-                    'name': short_name,
-                    'language': language
-                })
-            
-            # Sort by name
-            sounds.sort(key=lambda x: x['name'])
-            
-            if search:
+            if search and search.endswith('*'):
+                sounds = self.search_sound(search[:-1])
+            elif search:
                 search = search.lower()
-                sounds = [s for s in sounds if search in s['name'].lower() or search in str(s['id'])]
+                # Names are pre-lowercased in the index; ids can only match digits
+                match_ids = search.isdigit()
+                sounds = [s for s, key in zip(sounds, self._sound_names_lower)
+                          if search in key or (match_ids and search in str(s['id']))]
             
             print(f"Available sounds ({len(sounds)} total):")
             for s in sounds:
@@ -1036,6 +1776,17 @@ class CozmoController:
             print(f"Error listing sounds: {e}")
             return False
 
+    def _sound_cache_path(self, source: Path, st: os.stat_result) -> Path:
+        """Cache file for the robot-format (22050 Hz mono) conversion of source.
+
+        The key includes the source's mtime and size, so an edited file is
+        converted again.
+        """
+        key = hashlib.blake2b(
+            f"{source.resolve()}|{st.st_mtime_ns}|{st.st_size}".encode(), digest_size=16
+        ).hexdigest()
+        return self.tts_dir / f"sound_{key}.wav"
+
     def play_sound(self, name: str = None, file: str = None, async_mode: bool = False):
         """Play a sound from assets or a local file on the robot.
         
@@ -1049,96 +1800,114 @@ class CozmoController:
             return False
         
         def _play():
+            part_path = None
             try:
-                temp_wav = self.tts_dir / f"sound_{int(time.time())}_{uuid.uuid4().hex[:8]}.wav"
-                
                 if file:
                     file_path = Path(file)
-                    if not file_path.exists():
+                    try:
+                        st = os.stat(file_path)
+                    except FileNotFoundError:
                         print(f"File not found: {file}")
                         return
                     
-                    result = subprocess.run(
-                        ['ffmpeg', '-y', '-i', str(file_path), 
-                         '-acodec', 'pcm_s16le', '-ar', '22050', '-ac', '1',
-                         str(temp_wav)],
-                        capture_output=True, text=True
-                    )
-                    
-                    if result.returncode != 0:
-                        print(f"Error converting with ffmpeg:")
-                        print(result.stderr[:300] if result.stderr else "ffmpeg failed")
-                        return
+                    sound_wav = self._sound_cache_path(file_path, st)
+                    if sound_wav.exists():
+                        print("Using cached sound conversion")
+                    else:
+                        part_path = self._cache_temp_path(sound_wav.stem)
+                        result = subprocess.run(
+                            ['ffmpeg', '-y', '-i', str(file_path), 
+                             '-acodec', 'pcm_s16le', '-ar', '22050', '-ac', '1',
+                             str(part_path)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+                        )
+                        
+                        if result.returncode != 0:
+                            print(f"Error converting with ffmpeg:")
+                            print(result.stderr[:300] if result.stderr else "ffmpeg failed")
+                            return
+                        os.replace(part_path, sound_wav)
                     
                 elif name:
-                    import xml.etree.ElementTree as ET
-                    
                     sound_dir = pycozmo.util.get_cozmo_asset_dir() / "cozmo_resources" / "sound"
-                    info_path = sound_dir / "SoundbanksInfo.xml"
-                    
-                    if not info_path.exists():
-                        print(f"Sound assets info not found")
-                        return
-                    
-                    tree = ET.parse(info_path)
-                    root = tree.getroot()
-                    
-                    found_file = None
-                    for file_elem in root.findall('.//File'):
-                        short_name = file_elem.findtext('ShortName', '')
-                        if name.lower() in short_name.lower():
-                            found_file = file_elem
-                            break
+                    needle = name.lower()
+                    if self._soundbank_index is None and not self._soundbank_lock.locked():
+                        # Cold: parse the XML only up to this sound
+                        entry = self._find_cold_sound(sound_dir, needle)
+                    else:
+                        # Waits for an index build already in progress
+                        index = self._load_soundbank_index()
+                        if not index:
+                            return
+                        
+                        # Exact name first, then the first name containing it
+                        entry = index.get(needle) or next(
+                            (v for k, v in index.items() if needle in k), None)
                     
-                    if found_file is None:
+                    if entry is None:
                         print(f"Sound not found: {name}")
                         return
                     
-                    file_id = found_file.get('Id')
-                    short_name = found_file.findtext('ShortName', '')
-                    path_elem = found_file.findtext('Path', '')
+                    file_id, short_name, path_elem = entry
                     
                     wem_path = sound_dir / path_elem
                     if not wem_path.exists():
                         wem_path = sound_dir / f"{file_id}.wem"
                     
                     if not wem_path.exists():
-                        for root_dir, dirs, files in os.walk(sound_dir):
-                            for f in files:
-                                if f == f"{file_id}.wem":
-                                    wem_path = Path(root_dir) / f
-                                    break
+                        if self._wem_by_id is None:
+                            with self._soundbank_lock:
+                                if self._wem_by_id is None:
+                                    self._wem_by_id = self._scan_wem_files(sound_dir)
+                        wem_path = self._wem_by_id.get(file_id, wem_path)
                     
-                    if not wem_path.exists():
+                    try:
+                        st = os.stat(wem_path)
+                    except FileNotFoundError:
                         print(f"WEM file not found for sound {file_id}")
                         return
                     
-                    temp_raw = self.tts_dir / f"sound_{int(time.time())}_{uuid.uuid4().hex[:8]}_raw.wav"
-                    
-                    result = subprocess.run(
-                        ['vgmstream-cli', '-o', str(temp_raw), str(wem_path)],
-                        capture_output=True, text=True
-                    )
-                    
-                    if result.returncode != 0:
-                        print(f"Error converting with vgmstream-cli:")
-                        print(result.stderr[:300] if result.stderr else "vgmstream-cli failed")
-                        return
-                    
-                    result = subprocess.run(
-                        ['ffmpeg', '-y', '-i', str(temp_raw), 
-                         '-acodec', 'pcm_s16le', '-ar', '22050', '-ac', '1',
-                         str(temp_wav)],
-                        capture_output=True, text=True
-                    )
-                    
-                    if temp_raw.exists():
-                        temp_raw.unlink()
-                    
-                    if result.returncode != 0:
-                        print(f"Error converting with ffmpeg:")
-                        print(result.stderr[:300] if result.stderr else "ffmpeg failed")
-                        return
+                    sound_wav = self._sound_cache_path(wem_path, st)
+                    if sound_wav.exists():
+                        print("Using cached sound conversion")
+                    else:
+                        # Decode to memory, no intermediate file
+                        vgm = subprocess.run(
+                            ['vgmstream-cli', '-p', str(wem_path)],
+                            capture_output=True
+                        )
+                        
+                        if vgm.returncode != 0:
+                            print(f"Error converting with vgmstream-cli:")
+                            print(vgm.stderr[:300].decode(errors='replace') if vgm.stderr else "vgmstream-cli failed")
+                            return
+                        
+                        try:
+                            with wave.open(io.BytesIO(vgm.stdout), 'rb') as w:
+                                native = (w.getframerate() == 22050 and w.getnchannels() == 1
+                                          and w.getsampwidth() == 2)
+                        except (wave.Error, EOFError):
+                            native = False
+                        
+                        part_path = self._cache_temp_path(sound_wav.stem)
+                        if native:
+                            # Already 22050 Hz mono 16-bit: skip the ffmpeg pass
+                            part_path.write_bytes(vgm.stdout)
+                            print("Sound already in robot format, skipping ffmpeg")
+                        else:
+                            result = subprocess.run(
+                                ['ffmpeg', '-y', '-i', 'pipe:0',
+                                 '-acodec', 'pcm_s16le', '-ar', '22050', '-ac', '1',
+                                 str(part_path)],
+                                input=vgm.stdout, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+                            )
+                            
+                            if result.returncode != 0:
+                                print(f"Error converting with ffmpeg:")
+                                print(result.stderr[:300].decode(errors='replace') if result.stderr else "ffmpeg failed")
+                                return
+                            print("Resampled sound with ffmpeg")
+                        os.replace(part_path, sound_wav)
                     
                     print(f"Playing sound: {short_name}")
                     
@@ -1146,33 +1915,35 @@ class CozmoController:
                     print("Error: specify name= or file=")
                     return
                 
-                if not temp_wav.exists():
+                if not sound_wav.exists():
                     print(f"Error: converted file not created")
                     return
                 
-                import wave
-                with wave.open(str(temp_wav), 'r') as w:
+                with wave.open(str(sound_wav), 'r') as w:
                     duration = w.getnframes() / w.getframerate()
                 
-                self.cli.play_audio(str(temp_wav))
                 print(f"Sound duration: {duration:.1f}s")
-                time.sleep(duration + 0.5)
+                self._play_and_wait(lambda: self.cli.play_audio(str(sound_wav)), duration)
                 
             except Exception as e:
                 print(f"Error playing sound: {e}")
-                import traceback
                 traceback.print_exc()
+            finally:
+                # Remove a conversion that failed before being moved into the cache
+                if part_path is not None and part_path.exists():
+                    part_path.unlink()
 
         if async_mode:
             if file:
                 print(f"Playing sound (async): {Path(file).name}")
             elif name:
                 print(f"Playing sound (async): {name}")
-            self._run_in_background(_play)
+            self._queue_audio(_play)
         else:
             _play()
         return True
 
+    @_require_connected
     def display_text_on_screen(self, text: str, duration: float = 5.0, font_size: int = 12, 
                                 x: int = 5, y: int = 10, clear_after: bool = True):
         """Display text on Cozmo's OLED screen.
@@ -1187,13 +1958,7 @@ class CozmoController:
             y: Y position (default 10)
             clear_after: Clear screen after duration (default True)
         """
-        if not self.connected:
-            return False
-
         try:
-            img = Image.new('1', (128, 32), color=0)
-            draw = ImageDraw.Draw(img)
-            
             # Clamp font size
             font_size = max(8, min(24, font_size))
             
@@ -1204,37 +1969,35 @@ class CozmoController:
             text = text.replace('\\r', '\r')
             
             # Try to use a scalable font, fall back to default
-            font = None
-            font_path = '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf'
-            if os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, font_size)
-            
-            # Draw text
-            if font:
-                draw.text((x, y), text, fill=1, font=font)
-                print(f"Displaying with font size {font_size}: '{text}'")
-            else:
-                draw.text((x, y), text, fill=1)
-                print(f"Displaying with default font: '{text}'")
-            
-            # Display
-            self.cli.display_image(img)
-            time.sleep(duration)
+            font = _get_font(SCREEN_FONT_PATH, font_size)
+            
+            with self._SCREEN_LOCK:
+                img = self._blank_screen()
+                draw = ImageDraw.Draw(img)
+                
+                # Draw text
+                if font:
+                    draw.text((x, y), text, fill=1, font=font)
+                    print(f"Displaying with font size {font_size}: '{text}'")
+                else:
+                    draw.text((x, y), text, fill=1, font=_default_font())
+                    print(f"Displaying with default font: '{text}'")
+                
+                # Display
+                self.cli.display_image(img)
+            time.sleep(duration)
             
             if clear_after:
                 self.cli.clear_screen()
             return True
         except Exception as e:
             print(f"Error displaying text: {e}")
-            import traceback
             traceback.print_exc()
             return False
 
+    @_require_connected
     def capture_camera_image(self, output_path: str = "camera_capture.jpg"):
         """Capture an image from Cozmo's camera."""
-        if not self.connected:
-            return False
-
         try:
             # Set head to middle for best view
             self.set_head_angle(0.17)
@@ -1261,21 +2024,41 @@ class CozmoController:
 
     def _voltage_to_percentage(self, voltage: float) -> float:
         """Convert voltage to approximate percentage."""
-        # Cozmo Li-ion battery: 4.2V = 100%, 3.5V = 0%
-        min_v = 3.5
-        max_v = 4.2
-        pct = (voltage - min_v) / (max_v - min_v) * 100
+        pct = (voltage - BATTERY_MIN_V) * self._PCT_PER_VOLT
         return max(0, min(100, pct))
 
-    def _draw_battery_icon(self, percentage: float) -> Image:
-        """Create battery icon image."""
-        img = Image.new('1', (128, 32), color=0)
+    @classmethod
+    def _get_battery_template(cls) -> Image:
+        """Shared battery outline; callers must copy it before drawing."""
+        if cls._BATTERY_TEMPLATE is None:
+            img = Image.new('1', (128, 32), color=0)
+            draw = ImageDraw.Draw(img)
+            draw.rectangle([10, 8, 100, 24], outline=1, fill=0)  # Main body
+            draw.rectangle([100, 12, 104, 20], fill=1)  # Positive terminal
+            cls._BATTERY_TEMPLATE = img
+        return cls._BATTERY_TEMPLATE
+
+    @classmethod
+    def _blank_screen(cls) -> Image:
+        """Return the shared screen canvas, cleared.
+
+        Hold _SCREEN_LOCK from here until display_image() returns; pycozmo
+        encodes the image inside that call, so the canvas is free afterwards.
+        """
+        if cls._SCREEN_CANVAS is None:
+            cls._SCREEN_CANVAS = Image.new('1', (128, 32), color=0)
+        else:
+            cls._SCREEN_CANVAS.paste(0, (0, 0, 128, 32))
+        return cls._SCREEN_CANVAS
+
+    def _draw_battery_icon(self, percentage: float, img: Image = None) -> Image:
+        """Create battery icon image, or draw it onto img."""
+        if img is None:
+            img = self._get_battery_template().copy()
+        else:
+            img.paste(self._get_battery_template())
         draw = ImageDraw.Draw(img)
         
-        # Draw battery outline
-        draw.rectangle([10, 8, 100, 24], outline=1, fill=0)  # Main body
-        draw.rectangle([100, 12, 104, 20], fill=1)  # Positive terminal
-        
         # Draw fill level
         fill_width = int((percentage / 100) * 86)
         if fill_width > 0:
@@ -1283,20 +2066,19 @@ class CozmoController:
         
         # Draw percentage text
         text = f"{int(percentage)}%"
-        draw.text((110, 10), text, fill=1)
+        _render_line(img, text, 110, 10)
         
         return img
 
+    @_require_connected
     def display_battery_icon(self, duration: float = 5.0):
         """Display battery icon with fill level on screen."""
-        if not self.connected:
-            return False
-        
         try:
             voltage = self.get_battery_voltage()
             pct = self._voltage_to_percentage(voltage)
-            img = self._draw_battery_icon(pct)
-            self.cli.display_image(img)
+            with self._SCREEN_LOCK:
+                img = self._draw_battery_icon(pct, self._blank_screen())
+                self.cli.display_image(img)
             print(f"Battery: {voltage:.2f}V ({pct:.0f}%)")
             time.sleep(duration)
             self.cli.clear_screen()
@@ -1305,20 +2087,17 @@ class CozmoController:
             print(f"Error displaying battery icon: {e}")
             return False
 
+    @_require_connected
     def display_battery_voltage(self, duration: float = 5.0):
         """Display battery voltage as large text."""
-        if not self.connected:
-            return False
-        
         try:
             voltage = self.get_battery_voltage()
             text = f"{voltage:.2f}V"
             
-            img = Image.new('1', (128, 32), color=0)
-            draw = ImageDraw.Draw(img)
-            draw.text((20, 8), text, fill=1)
-            
-            self.cli.display_image(img)
+            with self._SCREEN_LOCK:
+                img = self._blank_screen()
+                _render_line(img, text, 20, 8)
+                self.cli.display_image(img)
             print(f"Voltage: {voltage:.2f}V")
             time.sleep(duration)
             self.cli.clear_screen()
@@ -1327,21 +2106,18 @@ class CozmoController:
             print(f"Error displaying voltage: {e}")
             return False
 
+    @_require_connected
     def display_battery_percentage(self, duration: float = 5.0):
         """Display battery percentage as large text."""
-        if not self.connected:
-            return False
-        
         try:
             voltage = self.get_battery_voltage()
             pct = self._voltage_to_percentage(voltage)
             text = f"{pct:.0f}%"
             
-            img = Image.new('1', (128, 32), color=0)
-            draw = ImageDraw.Draw(img)
-            draw.text((35, 8), text, fill=1)
-            
-            self.cli.display_image(img)
+            with self._SCREEN_LOCK:
+                img = self._blank_screen()
+                _render_line(img, text, 35, 8)
+                self.cli.display_image(img)
             print(f"Percentage: {pct:.0f}%")
             time.sleep(duration)
             self.cli.clear_screen()
@@ -1350,11 +2126,9 @@ class CozmoController:
             print(f"Error displaying percentage: {e}")
             return False
 
+    @_require_connected
     def display_battery_two_lines(self, duration: float = 5.0):
         """Display battery info on two lines."""
-        if not self.connected:
-            return False
-        
         try:
             voltage = self.get_battery_voltage()
             pct = self._voltage_to_percentage(voltage)
@@ -1362,12 +2136,11 @@ class CozmoController:
             line1 = f"BAT: {voltage:.2f}V"
             line2 = f"{pct:.0f}% CHARGED"
             
-            img = Image.new('1', (128, 32), color=0)
-            draw = ImageDraw.Draw(img)
-            draw.text((5, 2), line1, fill=1)
-            draw.text((5, 17), line2, fill=1)
-            
-            self.cli.display_image(img)
+            with self._SCREEN_LOCK:
+                img = self._blank_screen()
+                _render_line(img, line1, 5, 2)
+                _render_line(img, line2, 5, 17)
+                self.cli.display_image(img)
             print(f"Line 1: {line1}")
             print(f"Line 2: {line2}")
             time.sleep(duration)
@@ -1378,10 +2151,20 @@ class CozmoController:
             return False
 
     def get_battery_voltage(self) -> float:
-        """Get Cozmo's current battery voltage."""
+        """Get Cozmo's current battery voltage.
+
+        Readings are reused for BATTERY_CACHE_TTL seconds; the voltage
+        changes slowly and scripts may poll it in a loop.
+        """
+        now = time.monotonic()
+        stamp, voltage = self._battery_cache
+        if now - stamp < BATTERY_CACHE_TTL:
+            return voltage
         if not self.is_connected():
             return 0.0
-        return self.cli.battery_voltage
+        voltage = self.cli.battery_voltage
+        self._battery_cache = (now, voltage)
+        return voltage
 
     def get_status(self) -> Dict[str, Any]:
         """Get current robot status."""
@@ -1513,6 +2296,11 @@ class CommandParser:
             'opts': {'name': None, 'file': None, 'async': False},
             'varargs': True
         },
+        'wait-audio': {
+            'desc': 'Wait for async say/play-sound to finish',
+            'args': [],
+            'opts': {}
+        },
         'camera': {
             'desc': 'Capture image',
             'args': [],
@@ -1635,13 +2423,40 @@ class CommandParser:
     @staticmethod
     def _split_respecting_quotes(s):
         """Split string by spaces, but respect quoted substrings."""
-        import shlex
+        # Most script lines have nothing for shlex to interpret
+        if '"' not in s and "'" not in s and '\\' not in s:
+            return s.split()
         try:
             return shlex.split(s)
         except ValueError:
             # If shlex fails (e.g., unmatched quotes), fall back to simple split
             return s.split()
     
+    @classmethod
+    def _build_tables(cls):
+        """Precompute per-command option converters and argument counts.
+
+        parse_command then does one dict lookup and one call per option
+        instead of re-inspecting the default's type every time.
+        """
+        cls._OPT_CONVERTERS = {}
+        cls._REQUIRED_ARGC = {}
+        cls._VARARGS = {}
+        for cmd, info in cls.COMMANDS.items():
+            converters = {}
+            for key, default in info['opts'].items():
+                if isinstance(default, bool):
+                    converters[key] = cls._parse_bool
+                elif isinstance(default, int):
+                    converters[key] = int
+                elif isinstance(default, float):
+                    converters[key] = float
+                else:
+                    converters[key] = str
+            cls._OPT_CONVERTERS[cmd] = converters
+            cls._REQUIRED_ARGC[cmd] = len(info['args'])
+            cls._VARARGS[cmd] = info.get('varargs', False)
+    
     @classmethod
     def parse_command(cls, cmd_str):
         """Parse a single command string into (command, args, opts)."""
@@ -1653,52 +2468,33 @@ class CommandParser:
         if cmd not in cls.COMMANDS:
             raise ValueError(f"Unknown command: {cmd}")
         
-        cmd_info = cls.COMMANDS[cmd]
+        converters = cls._OPT_CONVERTERS[cmd]
+        argc = cls._REQUIRED_ARGC[cmd]
+        varargs = cls._VARARGS[cmd]
         args = []
         opts = {}
         
-        i = 1
-        arg_idx = 0
-        
-        while i < len(parts):
-            part = parts[i]
-            
+        for part in parts[1:]:
             # Check if it's an option (key=value)
             if '=' in part:
                 key, value = part.split('=', 1)
-                if key in cmd_info['opts']:
-                    # Parse value based on default type
-                    default = cmd_info['opts'][key]
-                    if isinstance(default, bool):
-                        opts[key] = cls._parse_bool(value)
-                    elif isinstance(default, int):
-                        opts[key] = int(value)
-                    elif isinstance(default, float):
-                        opts[key] = float(value)
-                    else:
-                        opts[key] = value
-                else:
+                convert = converters.get(key)
+                if convert is None:
                     raise ValueError(f"Unknown option '{key}' for command '{cmd}'")
+                opts[key] = convert(value)
+            # It's a positional argument; varargs commands (e.g. 'say') take any number
+            elif len(args) < argc or varargs:
+                args.append(part)
             else:
-                # It's a positional argument
-                if arg_idx < len(cmd_info['args']):
-                    args.append(part)
-                    arg_idx += 1
-                elif cmd_info.get('varargs', False):
-                    # Command accepts variable arguments (e.g., 'say' with multi-word text)
-                    args.append(part)
-                    arg_idx += 1
-                else:
-                    raise ValueError(f"Too many arguments for command '{cmd}'")
-            
-            i += 1
+                raise ValueError(f"Too many arguments for command '{cmd}'")
         
         # Check required args
-        if arg_idx < len(cmd_info['args']):
-            raise ValueError(f"Command '{cmd}' requires {len(cmd_info['args'])} arguments: {cmd_info['args']}")
+        if len(args) < argc:
+            cmd_args = cls.COMMANDS[cmd]['args']
+            raise ValueError(f"Command '{cmd}' requires {argc} arguments: {cmd_args}")
         
         # Fill in default options
-        for key, default in cmd_info['opts'].items():
+        for key, default in cls.COMMANDS[cmd]['opts'].items():
             if key not in opts:
                 opts[key] = default
         
@@ -1715,340 +2511,746 @@ class CommandParser:
         raise ValueError(f"Cannot parse '{value}' as boolean")
 
 
+CommandParser._build_tables()
+
+
+@functools.lru_cache(maxsize=2048)
+def _parse_command_cached(cmd_str: str) -> tuple:
+    """Memoized CommandParser.parse_command for repeated command strings.
+    
+    Returns (cmd, args, opts) with args as a tuple; results are shared
+    between callers, so handlers must treat args and opts as read-only.
+    """
+    parsed = CommandParser.parse_command(cmd_str)
+    if parsed is None:
+        return None  # Blank command string
+    cmd, args, opts = parsed
+    return cmd, tuple(args), opts
+
+
+def _cmd_connect(controller, args, opts):
+    """connect: Connect to robot."""
+    return controller.connect()
+
+
+def _cmd_status(controller, args, opts):
+    """status: Show robot status."""
+    time.sleep(1)
+    status = controller.get_status()
+    print("-" * 40)
+    for key, value in status.items():
+        print(f"  {key}: {value}")
+    print("-" * 40)
+    return True
+
+
+def _cmd_wait(controller, args, opts):
+    """wait: Wait for robot to stabilize."""
+    return controller.wait_for_robot()
+
+
+def _cmd_sleep(controller, args, opts):
+    """sleep: Pause execution."""
+    duration = float(args[0])
+    time.sleep(duration)
+    return True
+
+
+def _cmd_say(controller, args, opts):
+    """say: Text-to-speech."""
+    text = ' '.join(args)
+    volume = int(opts.get('volume', 65535))
+    voice = opts.get('voice', 'en-us')
+    speed = int(opts.get('speed', 150))
+    pitch = int(opts.get('pitch', 50))
+    amplitude = int(opts.get('amplitude', 100))
+    async_mode = opts.get('async', False)
+    effect = opts.get('effect', 'normal')
+    return controller.say_text(text, volume=volume, voice=voice, speed=speed, pitch=pitch, amplitude=amplitude, async_mode=async_mode, effect=effect)
+
+
+def _cmd_volume(controller, args, opts):
+    """volume: Set volume."""
+    level = int(args[0])
+    return controller.set_volume(level)
+
+
+def _cmd_move(controller, args, opts):
+    """move: Move forward/backward."""
+    distance = float(args[0])
+    speed = float(opts.get('speed', 100))
+    async_mode = opts.get('async', False)
+    return controller.move_forward(distance, speed, async_mode)
+
+
+def _cmd_turn(controller, args, opts):
+    """turn: Turn by angle."""
+    angle = float(args[0])
+    async_mode = opts.get('async', False)
+    return controller.turn_in_place(angle, async_mode=async_mode)
+
+
+def _cmd_goto(controller, args, opts):
+    """goto: Go to position."""
+    x = float(args[0])
+    y = float(args[1])
+    angle = float(opts.get('angle', 0))
+    angle_rad = math.radians(angle)
+    return controller.go_to_pose(x, y, angle_rad)
+
+
+def _cmd_head(controller, args, opts):
+    """head: Set head angle (aliases: down/bottom, middle/neutral, up/top, or radians)."""
+    if args:
+        angle_str = args[0].lower()
+    else:
+        angle_str = opts.get('angle', 'middle').lower()
+
+    head_aliases = {
+        'down': -0.44,
+        'bottom': -0.44,
+        'lower': -0.20,
+        'middle': 0.17,
+        'neutral': 0.17,
+        'center': 0.17,
+        'upper': 0.45,
+        'up': 0.78,
+        'top': 0.78,
+    }
+
+    if angle_str in head_aliases:
+        angle = head_aliases[angle_str]
+        print(f"Head position: {angle_str} ({angle:.2f} rad)")
+    else:
+        angle = float(angle_str)
+        print(f"Head angle: {angle:.2f} rad")
+
+    async_mode = opts.get('async', False)
+    return controller.set_head_angle(angle, async_mode)
+
+
+def _cmd_lift(controller, args, opts):
+    """lift: Move lift."""
+    speed = float(args[0])
+    duration = float(opts.get('duration', 1.0))
+    async_mode = opts.get('async', False)
+    return controller.move_lift(speed, duration, async_mode)
+
+
+def _cmd_lights(controller, args, opts):
+    """lights: Set LED color(s)."""
+    if opts.get('colors'):
+        colors = opts['colors'].split(',')
+        return controller.set_backpack_lights_individual(colors)
+    else:
+        return controller.set_backpack_lights(opts.get('color', 'blue'))
+
+
+def _cmd_ir(controller, args, opts):
+    """ir: IR head light."""
+    enable = opts.get('enable', True)
+    return controller.set_head_light(enable)
+
+
+def _cmd_cliff(controller, args, opts):
+    """cliff: Cliff detection settings."""
+    enable = opts.get('enable', True)
+    reaction = opts.get('reaction', 'backup')
+    controller.set_cliff_reaction(reaction)
+    return controller.enable_cliff_detection(enable)
+
+
+def _cmd_calibrate(controller, args, opts):
+    """calibrate: Calibrate motors."""
+    head = opts.get('head', True)
+    lift = opts.get('lift', True)
+    return controller.calibrate_motors(head=head, lift=lift)
+
+
+def _cmd_animate(controller, args, opts):
+    """animate: Play animation."""
+    name = args[0]
+    async_mode = opts.get('async', False)
+    wait_val = opts.get('wait')
+    wait = float(wait_val) if wait_val is not None else None
+    return controller.play_animation(name, async_mode=async_mode, wait=wait)
+
+
+def _cmd_anim_group(controller, args, opts):
+    """anim-group: Play animation group."""
+    group = args[0]
+    async_mode = opts.get('async', False)
+    wait_val = opts.get('wait')
+    wait = float(wait_val) if wait_val is not None else None
+    return controller.play_anim_group(group, async_mode=async_mode, wait=wait)
+
+
+def _cmd_list_anims(controller, args, opts):
+    """list-anims: List available animations."""
+    search = opts.get('search')
+    show_duration = opts.get('duration', False)
+    return controller.list_animations(search, show_duration=show_duration)
+
+
+def _cmd_list_groups(controller, args, opts):
+    """list-groups: List available animation groups."""
+    search = opts.get('search')
+    show_duration = opts.get('duration', False)
+    return controller.list_animation_groups(search, show_duration=show_duration)
+
+
+def _cmd_list_sounds(controller, args, opts):
+    """list-sounds: List available sounds."""
+    search = opts.get('search')
+    return controller.list_sounds(search)
+
+
+def _cmd_play_sound(controller, args, opts):
+    """play-sound: Play sound by name or file."""
+    name = opts.get('name')
+    file = opts.get('file')
+    async_mode = opts.get('async', False)
+    if name is None and file is None and args:
+        # First arg could be name or file path
+        arg = args[0]
+        if os.path.exists(arg):
+            file = arg
+        else:
+            name = arg
+    return controller.play_sound(name=name, file=file, async_mode=async_mode)
+
+
+def _cmd_wait_audio(controller, args, opts):
+    """wait-audio: Wait for async say/play-sound to finish."""
+    return controller.wait_for_audio()
+
+
+def _cmd_camera(controller, args, opts):
+    """camera: Capture image."""
+    output = opts.get('output', 'camera_capture.jpg')
+    result = controller.capture_camera_image(output)
+    if result:
+        print(f"  Saved to: {result}")
+    return bool(result)
+
+
+def _cmd_battery(controller, args, opts):
+    """battery: Show battery."""
+    mode = opts.get('mode', 'icon')
+    duration = float(opts.get('duration', 5.0))
+
+    controller.set_head_angle(0.17)
+    time.sleep(0.5)
+
+    if mode == 'icon':
+        return controller.display_battery_icon(duration)
+    elif mode == 'voltage':
+        return controller.display_battery_voltage(duration)
+    elif mode == 'percent':
+        return controller.display_battery_percentage(duration)
+    elif mode == 'text':
+        return controller.display_battery_two_lines(duration)
+    else:
+        voltage = controller.get_battery_voltage()
+        print(f"  Battery: {voltage:.2f}V")
+        return True
+
+
+def _cmd_screen(controller, args, opts):
+    """screen: Display text."""
+    text = ' '.join(args)
+    duration = float(opts.get('duration', 5.0))
+    size = int(opts.get('size', 12))
+    x = int(opts.get('x', 5))
+    y = int(opts.get('y', 10))
+    return controller.display_text_on_screen(text, duration=duration, font_size=size, x=x, y=y)
+
+
+# Command name -> handler(controller, args, opts)
+_DISPATCH = {
+    'connect': _cmd_connect,
+    'status': _cmd_status,
+    'wait': _cmd_wait,
+    'sleep': _cmd_sleep,
+    'say': _cmd_say,
+    'volume': _cmd_volume,
+    'move': _cmd_move,
+    'turn': _cmd_turn,
+    'goto': _cmd_goto,
+    'head': _cmd_head,
+    'lift': _cmd_lift,
+    'lights': _cmd_lights,
+    'ir': _cmd_ir,
+    'cliff': _cmd_cliff,
+    'calibrate': _cmd_calibrate,
+    'animate': _cmd_animate,
+    'anim-group': _cmd_anim_group,
+    'list-anims': _cmd_list_anims,
+    'list-groups': _cmd_list_groups,
+    'list-sounds': _cmd_list_sounds,
+    'play-sound': _cmd_play_sound,
+    'wait-audio': _cmd_wait_audio,
+    'camera': _cmd_camera,
+    'battery': _cmd_battery,
+    'screen': _cmd_screen,
+}
+
+
 def execute_command(controller, cmd, args, opts):
     """Execute a single parsed command."""
-    print(f"\n>>> {cmd} {args} {opts}")
-    
-    if cmd == 'connect':
-        return controller.connect()
-    
-    elif cmd == 'status':
-        time.sleep(1)
-        status = controller.get_status()
-        print("-" * 40)
-        for key, value in status.items():
-            print(f"  {key}: {value}")
-        print("-" * 40)
-        return True
-    
-    elif cmd == 'wait':
-        return controller.wait_for_robot()
+    print(f"\n>>> {cmd} {list(args)} {opts}")
     
-    elif cmd == 'sleep':
-        duration = float(args[0])
-        time.sleep(duration)
-        return True
+    handler = _DISPATCH.get(cmd)
+    if handler is None:
+        return False
+    return handler(controller, args, opts)
+
+
+# Script syntax patterns, compiled once for the interpreter's hot paths
+_RE_INCLUDE = re.compile(r'^include\s+(.+)$', re.IGNORECASE)
+_RE_SET = re.compile(r'^set\s+(\w+)\s*=?\s*(.*)$', re.IGNORECASE)
+_RE_FOR = re.compile(r'^for\s+(\w+)\s+in\s+(.+)$', re.IGNORECASE)
+_RE_RANGE = re.compile(r'^(\d+)\.\.(\d+)(?:\s+step\s+(\d+))?$')
+_RE_WHILE = re.compile(r'^while\s+(.+)$', re.IGNORECASE)
+_RE_IF = re.compile(r'^if\s+(.+)$', re.IGNORECASE)
+_RE_CALL = re.compile(r'^call\s+(\w+)(?:\s+(.*))?$', re.IGNORECASE)
+_RE_SAFE_EXPR = re.compile(r'^[\d\s\+\-\*\/\%\(\)\.]+$')
+_RE_VAR_REF = re.compile(r'\$\{(\w+)\}|\$(\w+)')
+# One whitespace-delimited value: "double", 'single' or bare (shlex's whitespace set)
+_RE_VALUE_TOKEN = re.compile(r'[ \t\r\n]*(?:"([^"\\]*)"|\'([^\']*)\'|([^ \t\r\n"\'\\]+))(?=[ \t\r\n]|$)')
+
+# Script instruction opcodes (see ScriptInterpreter._compile_block)
+(_OP_CMD, _OP_SET, _OP_JUMP, _OP_JUMP_IF_FALSE, _OP_FOR, _OP_FOR_NEXT,
+ _OP_WHILE, _OP_WHILE_TEST, _OP_CALL, _OP_INCLUDE) = range(10)
+_LOOP_DONE = object()  # Sentinel for an exhausted for loop
+
+# Script line kinds, from the first word of each line (see _tag_line)
+(_KIND_CMD, _KIND_BLANK, _KIND_DEF, _KIND_INCLUDE, _KIND_SET, _KIND_FOR, _KIND_WHILE,
+ _KIND_IF, _KIND_CALL, _KIND_ELSE, _KIND_ENDIF, _KIND_ENDFOR, _KIND_ENDWHILE, _KIND_ENDDEF) = range(14)
+_KEYWORDS = {
+    'def': _KIND_DEF, 'include': _KIND_INCLUDE, 'set': _KIND_SET, 'for': _KIND_FOR,
+    'while': _KIND_WHILE, 'if': _KIND_IF, 'call': _KIND_CALL, 'else': _KIND_ELSE,
+    'endif': _KIND_ENDIF, 'endfor': _KIND_ENDFOR, 'endwhile': _KIND_ENDWHILE, 'enddef': _KIND_ENDDEF,
+}
+_BARE_KEYWORDS = frozenset((_KIND_ELSE, _KIND_ENDIF, _KIND_ENDFOR, _KIND_ENDWHILE, _KIND_ENDDEF))
+_BLOCK_CLOSERS = {_KIND_FOR: _KIND_ENDFOR, _KIND_WHILE: _KIND_ENDWHILE, _KIND_IF: _KIND_ENDIF,
+                  _KIND_DEF: _KIND_ENDDEF}
+
+
+def _tag_line(line: str) -> tuple:
+    """Classify a script line by its first word, returning (kind, stripped line).
+    
+    Empty lines and comments are tagged _KIND_BLANK.
+    """
+    line = line.strip()
+    if not line or line[0] == '#':
+        return _KIND_BLANK, line
+    
+    parts = line.split(None, 1)
+    kind = _KEYWORDS.get(parts[0].lower(), _KIND_CMD)
+    # Block keywords need an argument and terminators stand alone; anything else is a command
+    if kind != _KIND_CMD and (len(parts) == 1) != (kind in _BARE_KEYWORDS):
+        kind = _KIND_CMD
+    return kind, line
+
+
+# Script arithmetic: numbers, $var / ${var} operands, binary + - * / // % **, unary + -, parentheses
+_RE_ARITH_TOKEN = re.compile(
+    r'\s*(?:(\d+\.?\d*|\.\d+)|(\*\*|//|[-+*/%()])|\$\{(\w+)\}|\$(\w+)|(\S))')
+_RE_PLAIN_NUMBER = re.compile(r'\d+\.?\d*|\.\d+')
+_ARITH_BINARY = {
+    '+': (1, operator.add), '-': (1, operator.sub),
+    '*': (2, operator.mul), '/': (2, operator.truediv),
+    '//': (2, operator.floordiv), '%': (2, operator.mod),
+    '**': (4, operator.pow),  # Right-associative, binds tighter than unary minus
+}
+_ARITH_UNARY = {'+': operator.pos, '-': operator.neg}
+_ARITH_UNARY_PREC = 3
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_arith(expr: str):
+    """Compile an arithmetic expression to RPN with shunting-yard.
+    
+    Variables and arithmetic are tokenized in the same pass. Returns
+    (rpn, names): rpn is a tuple of numbers, variable names (str) and
+    (arity, func) operator entries, and names lists the variables used.
+    Returns None if the expression is not valid arithmetic (e.g. '1 2',
+    '07', '(1+2', '$a$b').
+    """
+    output = []
+    names = []
+    stack = []  # Pending operators as (prec, arity, func), '(' as None
+    expect_operand = True
     
-    elif cmd == 'say':
-        text = ' '.join(args)
-        volume = int(opts.get('volume', 65535))
-        voice = opts.get('voice', 'en-us')
-        speed = int(opts.get('speed', 150))
-        pitch = int(opts.get('pitch', 50))
-        amplitude = int(opts.get('amplitude', 100))
-        async_mode = opts.get('async', False)
-        effect = opts.get('effect', 'normal')
-        return controller.say_text(text, volume=volume, voice=voice, speed=speed, pitch=pitch, amplitude=amplitude, async_mode=async_mode, effect=effect)
-    
-    elif cmd == 'volume':
-        level = int(args[0])
-        return controller.set_volume(level)
-    
-    elif cmd == 'move':
-        distance = float(args[0])
-        speed = float(opts.get('speed', 100))
-        async_mode = opts.get('async', False)
-        return controller.move_forward(distance, speed, async_mode)
-    
-    elif cmd == 'turn':
-        angle = float(args[0])
-        async_mode = opts.get('async', False)
-        return controller.turn_in_place(angle, async_mode=async_mode)
-    
-    elif cmd == 'goto':
-        x = float(args[0])
-        y = float(args[1])
-        angle = float(opts.get('angle', 0))
-        angle_rad = angle * 3.14159 / 180.0
-        return controller.go_to_pose(x, y, angle_rad)
-    
-    elif cmd == 'head':
-        if args:
-            angle_str = args[0].lower()
-        else:
-            angle_str = opts.get('angle', 'middle').lower()
-        
-        head_aliases = {
-            'down': -0.44,
-            'bottom': -0.44,
-            'lower': -0.20,
-            'middle': 0.17,
-            'neutral': 0.17,
-            'center': 0.17,
-            'upper': 0.45,
-            'up': 0.78,
-            'top': 0.78,
-        }
-        
-        if angle_str in head_aliases:
-            angle = head_aliases[angle_str]
-            print(f"Head position: {angle_str} ({angle:.2f} rad)")
-        else:
-            angle = float(angle_str)
-            print(f"Head angle: {angle:.2f} rad")
-        
-        async_mode = opts.get('async', False)
-        return controller.set_head_angle(angle, async_mode)
-    
-    elif cmd == 'lift':
-        speed = float(args[0])
-        duration = float(opts.get('duration', 1.0))
-        async_mode = opts.get('async', False)
-        return controller.move_lift(speed, duration, async_mode)
-    
-    elif cmd == 'lights':
-        if opts.get('colors'):
-            colors = opts['colors'].split(',')
-            return controller.set_backpack_lights_individual(colors)
+    for number, op, brace_var, bare_var, junk in _RE_ARITH_TOKEN.findall(expr):
+        if junk:
+            return None
+        if brace_var or bare_var:
+            if not expect_operand:
+                return None
+            name = brace_var or bare_var
+            output.append(name)
+            if name not in names:
+                names.append(name)
+            expect_operand = False
+        elif number:
+            if not expect_operand:
+                return None
+            if '.' in number:
+                output.append(float(number))
+            elif number[0] == '0' and number.strip('0'):
+                return None  # Leading zeros are not a valid literal
+            else:
+                output.append(int(number))
+            expect_operand = False
+        elif op == '(':
+            if not expect_operand:
+                return None
+            stack.append(None)
+        elif op == ')':
+            if expect_operand:
+                return None
+            while stack and stack[-1] is not None:
+                output.append(stack.pop()[1:])
+            if not stack:
+                return None
+            stack.pop()
+        elif expect_operand:
+            # Prefix operator: pushed without popping anything
+            if op not in _ARITH_UNARY:
+                return None
+            stack.append((_ARITH_UNARY_PREC, 1, _ARITH_UNARY[op]))
         else:
-            return controller.set_backpack_lights(opts.get('color', 'blue'))
-    
-    elif cmd == 'ir':
-        enable = opts.get('enable', True)
-        return controller.set_head_light(enable)
-    
-    elif cmd == 'cliff':
-        enable = opts.get('enable', True)
-        reaction = opts.get('reaction', 'backup')
-        controller.set_cliff_reaction(reaction)
-        return controller.enable_cliff_detection(enable)
-    
-    elif cmd == 'calibrate':
-        head = opts.get('head', True)
-        lift = opts.get('lift', True)
-        return controller.calibrate_motors(head=head, lift=lift)
-    
-    elif cmd == 'animate':
-        name = args[0]
-        async_mode = opts.get('async', False)
-        wait_val = opts.get('wait')
-        wait = float(wait_val) if wait_val is not None else None
-        return controller.play_animation(name, async_mode=async_mode, wait=wait)
-    
-    elif cmd == 'anim-group':
-        group = args[0]
-        async_mode = opts.get('async', False)
-        wait_val = opts.get('wait')
-        wait = float(wait_val) if wait_val is not None else None
-        return controller.play_anim_group(group, async_mode=async_mode, wait=wait)
-    
-    elif cmd == 'list-anims':
-        search = opts.get('search')
-        show_duration = opts.get('duration', False)
-        return controller.list_animations(search, show_duration=show_duration)
-    
-    elif cmd == 'list-groups':
-        search = opts.get('search')
-        show_duration = opts.get('duration', False)
-        return controller.list_animation_groups(search, show_duration=show_duration)
-    
-    elif cmd == 'list-sounds':
-        search = opts.get('search')
-        return controller.list_sounds(search)
-    
-    elif cmd == 'play-sound':
-        name = opts.get('name')
-        file = opts.get('file')
-        async_mode = opts.get('async', False)
-        if name is None and file is None and args:
-            # First arg could be name or file path
-            arg = args[0]
-            if os.path.exists(arg):
-                file = arg
+            prec, func = _ARITH_BINARY[op]
+            right_assoc = op == '**'
+            while stack and stack[-1] is not None and (
+                    stack[-1][0] > prec or (stack[-1][0] == prec and not right_assoc)):
+                output.append(stack.pop()[1:])
+            stack.append((prec, 2, func))
+            expect_operand = True
+    
+    if expect_operand:
+        return None
+    while stack:
+        entry = stack.pop()
+        if entry is None:
+            return None
+        output.append(entry[1:])
+    return tuple(output), tuple(names)
+
+
+def _eval_rpn(rpn: tuple, bindings: dict = None):
+    """Evaluate an RPN program from _compile_arith, taking variables from bindings."""
+    values = []
+    for item in rpn:
+        cls = item.__class__
+        if cls is tuple:
+            arity, func = item
+            if arity == 1:
+                values[-1] = func(values[-1])
             else:
-                name = arg
-        return controller.play_sound(name=name, file=file, async_mode=async_mode)
-    
-    elif cmd == 'camera':
-        output = opts.get('output', 'camera_capture.jpg')
-        result = controller.capture_camera_image(output)
-        if result:
-            print(f"  Saved to: {result}")
-        return bool(result)
-    
-    elif cmd == 'battery':
-        mode = opts.get('mode', 'icon')
-        duration = float(opts.get('duration', 5.0))
-        
-        controller.set_head_angle(0.17)
-        time.sleep(0.5)
-        
-        if mode == 'icon':
-            return controller.display_battery_icon(duration)
-        elif mode == 'voltage':
-            return controller.display_battery_voltage(duration)
-        elif mode == 'percent':
-            return controller.display_battery_percentage(duration)
-        elif mode == 'text':
-            return controller.display_battery_two_lines(duration)
+                right = values.pop()
+                values[-1] = func(values[-1], right)
+        elif cls is str:
+            values.append(bindings[item])
         else:
-            voltage = controller.get_battery_voltage()
-            print(f"  Battery: {voltage:.2f}V")
-            return True
+            values.append(item)
+    return values[0]
+
+
+def _plain_number(value):
+    """The number a variable's text reads as in an expression, if it is one unsigned literal.
+    
+    Returns None for anything else (signs, spaces, exponents, words, leading
+    zeros); such values are substituted as text instead, since e.g. -3 in
+    '$a**2' does not act as one operand.
+    """
+    cls = value.__class__
+    if cls is int:
+        return value if value >= 0 else None
+    text = value if cls is str else str(value)
+    if not _RE_PLAIN_NUMBER.fullmatch(text):
+        return None
+    if '.' in text:
+        return float(text)
+    if text[0] == '0' and text.strip('0'):
+        return None
+    return int(text)
+
+
+@functools.lru_cache(maxsize=1024)
+def _var_template(line: str) -> tuple:
+    """Split a line around its $var / ${var} references, once per distinct line.
+    
+    Returns (head, ((name, literal), ...)); the expansion is head followed by
+    each variable's value and the literal text after it.
+    """
+    # re.split yields: literal, brace name, bare name, literal, ...
+    pieces = _RE_VAR_REF.split(line)
+    names = [brace or bare for brace, bare in zip(pieces[1::3], pieces[2::3])]
+    return pieces[0], tuple(zip(names, pieces[3::3]))
+
+
+# Comparison operators in priority order, longest first so '>=' is not read as '>'.
+# A condition with several operators splits at the first one in this order,
+# not at the leftmost one.
+_COND_OPS = (('==', operator.eq), ('!=', operator.ne), ('>=', operator.ge),
+             ('<=', operator.le), ('>', operator.gt), ('<', operator.lt))
+
+
+@functools.lru_cache(maxsize=1024)
+def _split_condition(condition: str):
+    """Split an expanded condition into (compare, left, right), or None if it has no operator."""
+    for op, compare in _COND_OPS:
+        if op in condition:
+            left, right = condition.split(op, 1)
+            return compare, left.strip(), right.strip()
+    return None
+
+
+class Instr:
+    """One compiled script instruction: an opcode and up to two operands."""
+    __slots__ = ('op', 'a', 'b')
     
-    elif cmd == 'screen':
-        text = ' '.join(args)
-        duration = float(opts.get('duration', 5.0))
-        size = int(opts.get('size', 12))
-        x = int(opts.get('x', 5))
-        y = int(opts.get('y', 10))
-        return controller.display_text_on_screen(text, duration=duration, font_size=size, x=x, y=y)
+    def __init__(self, op: int, a=None, b=None):
+        self.op = op
+        self.a = a
+        self.b = b
     
-    return False
+    def __repr__(self):
+        return f"Instr({self.op}, {self.a!r}, {self.b!r})"
+
+
+class ScriptError(ValueError):
+    """A script produced a command that cannot be parsed (already reported)."""
 
 
 class ScriptInterpreter:
-    """Interpreter for advanced script features: variables, loops, conditions, subroutines."""
+    """Interpreter for advanced script features: variables, loops, conditions, subroutines.
+    
+    Scripts are compiled once into a flat list of Instr objects (commands are
+    parsed at compile time unless they reference variables, control flow
+    becomes jumps) and then run, so loop bodies are not re-expanded and
+    re-tokenized on every iteration.
+    """
     
     def __init__(self):
-        self.variables = {}
+        self.variables = {}  # Global scope
+        # Variable scopes, innermost last: globals, then one per active for loop / call
+        self._scopes = [self.variables]
         self.subroutines = {}
         self.max_iterations = 1000  # Safety limit for loops
+        self._include_cache = {}  # path -> (mtime, parsed commands)
     
     def preprocess(self, lines: list, base_dir: Path = None) -> list:
-        """Preprocess script lines, expanding control structures.
+        """Compile and run script lines, collecting every command.
         
         Args:
             lines: List of raw script lines
             base_dir: Base directory for includes
         
         Returns:
-            List of expanded command strings
+            List of parsed (cmd, args, opts) commands
+        
+        Raises:
+            ValueError: If a command produced by the script cannot be parsed
         """
-        # First pass: extract subroutines
-        lines = self._extract_subroutines(lines)
-        
-        # Second pass: expand control structures
-        return self._expand_block(lines, base_dir)
-    
-    def _extract_subroutines(self, lines: list) -> list:
-        """Extract subroutine definitions and return remaining lines."""
-        result = []
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
+        return list(self.preprocess_stream(lines, base_dir))
+    
+    def preprocess_stream(self, lines: list, base_dir: Path = None):
+        """Compile script lines and lazily yield parsed (cmd, args, opts) commands.
+        
+        The script runs as the generator is consumed, so a long loop never
+        materializes more than the command currently being produced.
+        """
+        yield from self.run(self.compile(lines, base_dir))
+    
+    def compile(self, lines: list, base_dir: Path = None) -> list:
+        """Compile raw script lines into an instruction list for run().
+        
+        Subroutine definitions are compiled into self.subroutines as a side effect.
+        
+        Raises:
+            ScriptError: If a line that doesn't reference variables cannot be parsed
+        """
+        # Lines are stripped, classified and block structure resolved once;
+        # blank lines and comments are dropped here, so compiling only sees
+        # (kind, line, line number) entries and never rescans for an end keyword
+        tagged = []
+        for lineno, line in enumerate(lines, 1):
+            kind, line = _tag_line(line)
+            if kind != _KIND_BLANK:
+                tagged.append((kind, line, lineno))
+        lines = tagged
+        table = self._build_jump_table(lines)
+        return self._compile_block(lines, table, 0, len(lines), base_dir)
+    
+    def run(self, code: list):
+        """Run compiled code, yielding each parsed (cmd, args, opts) command as it is reached.
+        
+        Raises:
+            ScriptError: If a command line expands to something that cannot be parsed
+        """
+        return self._execute(code)
+    
+    def needs_connection(self, code: list, offline_commands) -> bool:
+        """Whether running code may issue a command outside offline_commands.
+        
+        Decided from the compiled program and all subroutines, so a streamed
+        script knows before its first command whether to connect. Includes and
+        lines whose command name comes from a variable count as online.
+        """
+        for block in (code, *self.subroutines.values()):
+            for instr in block:
+                if instr.op == _OP_INCLUDE:
+                    return True
+                if instr.op == _OP_CMD:
+                    name = instr.b[0] if instr.b is not None else instr.a.split(None, 1)[0]
+                    if '$' in name or name not in offline_commands:
+                        return True
+        return False
+    
+    def _build_jump_table(self, lines: list) -> dict:
+        """Match block openers to their closers in one pass over tagged lines.
+        
+        Maps each for/while line to its endfor/endwhile, each def to its
+        enddef, and each if to its endif - or, when the if has an else, the
+        if to the else and the else to the endif. A closer or else with no
+        block open at all is left to the compiler, which reports it as
+        unexpected.
+        
+        Raises:
+            ScriptError: If blocks are unbalanced - an opener without its
+                closer, or a closer or else inside a different kind of block
+        """
+        table = {}
+        blocks = []  # Open blocks: [line index, closing kind, else index]
+        
+        for i, (kind, line, lineno) in enumerate(lines):
+            if kind == _KIND_CMD:
+                continue
             
-            if line.lower().startswith('def '):
-                # Extract subroutine name
-                parts = line.split(None, 1)
-                if len(parts) < 2:
-                    print(f"Error: Invalid def syntax: {line}")
-                    i += 1
+            if kind in _BLOCK_CLOSERS:
+                blocks.append([i, _BLOCK_CLOSERS[kind], None])
+            elif kind in _BARE_KEYWORDS and blocks:
+                start, closer, else_idx = blocks[-1]
+                if kind == _KIND_ELSE:
+                    if closer != _KIND_ENDIF:
+                        self._unbalanced(f"{line} at line {lineno} inside", lines[start])
+                    if else_idx is None:
+                        blocks[-1][2] = i
                     continue
-                
-                sub_name = parts[1].strip()
-                sub_lines = []
-                i += 1
-                depth = 1
-                
-                while i < len(lines) and depth > 0:
-                    sub_line = lines[i].strip().lower()
-                    if sub_line.startswith('def '):
-                        depth += 1
-                    elif sub_line == 'enddef':
-                        depth -= 1
-                        if depth == 0:
-                            break
-                    sub_lines.append(lines[i])
-                    i += 1
-                
-                self.subroutines[sub_name] = sub_lines
-                i += 1
-            else:
-                result.append(lines[i])
-                i += 1
+                if kind != closer:
+                    self._unbalanced(f"{line} at line {lineno} does not close", lines[start])
+                blocks.pop()
+                if else_idx is None:
+                    table[start] = i
+                else:
+                    table[start] = else_idx
+                    table[else_idx] = i
         
-        return result
+        if blocks:
+            self._unbalanced("No matching end for", lines[blocks[-1][0]])
+        return table
     
-    def _expand_block(self, lines: list, base_dir: Path, depth: int = 0) -> list:
-        """Expand a block of lines, handling control structures."""
+    @staticmethod
+    def _unbalanced(message: str, opener: tuple):
+        """Report an unbalanced block and stop compiling."""
+        _, line, lineno = opener
+        message = f"{message} '{line}' at line {lineno}"
+        print(f"Error: {message}")
+        raise ScriptError(message)
+    
+    # ---- Compiler: script lines -> Instr list ----
+    
+    def _compile_block(self, lines: list, table: dict, start: int, stop: int,
+                       base_dir: Path, code: list = None, depth: int = 0) -> list:
+        """Compile tagged lines[start:stop], appending instructions to code."""
+        if code is None:
+            code = []
+        
         if depth > 50:
             print("Error: Maximum nesting depth exceeded")
-            return []
+            return code
         
-        result = []
-        i = 0
+        i = start
         
-        while i < len(lines):
-            line = lines[i].strip()
+        while i < stop:
+            kind, line, lineno = lines[i]
             
-            # Skip empty lines and comments
-            if not line or line.startswith('#'):
+            # Regular command
+            if kind == _KIND_CMD:
+                code.append(self._compile_command(line))
                 i += 1
-                continue
             
-            lower_line = line.lower()
+            # Handle subroutine definition
+            elif kind == _KIND_DEF:
+                i = self._compile_def(lines, table, i, base_dir)
             
             # Handle include
-            if lower_line.startswith('include '):
-                included = self._handle_include(line, base_dir)
-                result.extend(included)
+            elif kind == _KIND_INCLUDE:
+                self._compile_include(line, base_dir, code)
                 i += 1
-                continue
             
             # Handle set variable
-            if lower_line.startswith('set '):
-                self._handle_set(line)
+            elif kind == _KIND_SET:
+                self._compile_set(line, code)
                 i += 1
-                continue
             
             # Handle for loop
-            if lower_line.startswith('for '):
-                expanded, new_i = self._handle_for(lines, i, base_dir, depth)
-                result.extend(expanded)
-                i = new_i
-                continue
+            elif kind == _KIND_FOR:
+                i = self._compile_for(lines, table, i, base_dir, code, depth)
             
             # Handle while loop
-            if lower_line.startswith('while '):
-                expanded, new_i = self._handle_while(lines, i, base_dir, depth)
-                result.extend(expanded)
-                i = new_i
-                continue
+            elif kind == _KIND_WHILE:
+                i = self._compile_while(lines, table, i, base_dir, code, depth)
             
             # Handle if condition
-            if lower_line.startswith('if '):
-                expanded, new_i = self._handle_if(lines, i, base_dir, depth)
-                result.extend(expanded)
-                i = new_i
-                continue
+            elif kind == _KIND_IF:
+                i = self._compile_if(lines, table, i, base_dir, code, depth)
             
             # Handle call subroutine
-            if lower_line.startswith('call '):
-                expanded = self._handle_call(line, base_dir, depth)
-                result.extend(expanded)
+            elif kind == _KIND_CALL:
+                self._compile_call(line, code)
                 i += 1
-                continue
             
             # Handle else/endif/endfor/endwhile (should not appear here)
-            if lower_line in ('else', 'endif', 'endfor', 'endwhile', 'enddef'):
-                print(f"Warning: Unexpected {line} at line {i+1}")
+            else:
+                print(f"Warning: Unexpected {line} at line {lineno}")
                 i += 1
-                continue
-            
-            # Regular command - expand variables
-            expanded_line = self._expand_variables(line)
-            result.append(expanded_line)
-            i += 1
         
-        return result
+        return code
     
-    def _handle_include(self, line: str, base_dir: Path) -> list:
-        """Handle include directive."""
-        import re
-        match = re.match(r'^include\s+(.+)$', line, re.IGNORECASE)
+    def _compile_def(self, lines: list, table: dict, start: int, base_dir: Path) -> int:
+        """Compile a subroutine definition into self.subroutines."""
+        line = lines[start][1]
+        
+        # Extract subroutine name
+        parts = line.split(None, 1)
+        if len(parts) < 2:
+            print(f"Error: Invalid def syntax: {line}")
+            return start + 1
+        
+        end = table[start]
+        
+        # Compiled once here; every call runs the same instructions
+        self.subroutines[parts[1].strip()] = self._compile_block(lines, table, start + 1, end, base_dir)
+        return end + 1
+    
+    def _compile_command(self, line: str) -> Instr:
+        """Compile a command line, parsing it now unless it references variables."""
+        parsed = None
+        if '$' not in line:
+            # A bad static line rejects the script before anything runs
+            parsed = self._parse_command(line)
+        return Instr(_OP_CMD, line, parsed)
+    
+    def _compile_include(self, line: str, base_dir: Path, code: list):
+        """Compile include directive."""
+        match = _RE_INCLUDE.match(line)
         if not match:
-            return []
+            return
         
         include_arg = match.group(1).strip()
         if (include_arg.startswith('"') and include_arg.endswith('"')) or \
@@ -2059,23 +3261,19 @@ class ScriptInterpreter:
         if not include_path.is_absolute() and base_dir:
             include_path = base_dir / include_arg
         
-        if not include_path.exists():
-            print(f"Error: Include file not found: {include_path}")
-            return []
-        
-        return load_script_file(include_path, include_path.parent)
+        # Kept as a plain string so each run checks the cache without Path objects
+        code.append(Instr(_OP_INCLUDE, str(include_path)))
     
-    def _handle_set(self, line: str):
-        """Handle set variable: set varname value or set varname="value"."""
-        import re
+    def _compile_set(self, line: str, code: list):
+        """Compile set variable: set varname value or set varname="value"."""
         
         # Match: set varname value or set varname="value with spaces"
-        match = re.match(r'^set\s+(\w+)\s*=?\s*(.*)$', line, re.IGNORECASE)
+        match = _RE_SET.match(line)
         if not match:
             print(f"Error: Invalid set syntax: {line}")
             return
         
-        var_name = match.group(1)
+        var_name = sys.intern(match.group(1))
         value = match.group(2).strip()
         
         # Remove quotes if present
@@ -2083,297 +3281,376 @@ class ScriptInterpreter:
            (value.startswith("'") and value.endswith("'")):
             value = value[1:-1]
         
-        # Try to evaluate as expression
-        value = self._evaluate_expression(value)
-        
-        self.variables[var_name] = value
-        print(f"  [set {var_name} = {value}]")
+        code.append(Instr(_OP_SET, var_name, value))
     
-    def _evaluate_expression(self, expr: str):
-        """Evaluate an expression (math, variables, etc.)."""
-        import re
+    def _compile_for(self, lines: list, table: dict, start: int,
+                     base_dir: Path, code: list, depth: int) -> int:
+        """Compile for loop: for var in 1..5 or for var in a b c."""
         
-        # First expand any variables
-        expr = self._expand_variables(expr)
-        
-        # Try simple arithmetic: number op number
-        try:
-            # Only allow safe characters for eval
-            if re.match(r'^[\d\s\+\-\*\/\%\(\)\.]+$', expr):
-                result = eval(expr)
-                if isinstance(result, float) and result == int(result):
-                    return int(result)
-                return result
-        except:
-            pass
-        
-        return expr
-    
-    def _expand_variables(self, line: str) -> str:
-        """Expand $var and ${var} references in a line."""
-        import re
-        
-        def replace_var(match):
-            var_name = match.group(1) or match.group(2)
-            return str(self.variables.get(var_name, ''))
-        
-        # Match $varname or ${varname}
-        line = re.sub(r'\$\{(\w+)\}', replace_var, line)
-        line = re.sub(r'\$(\w+)', replace_var, line)
-        
-        return line
-    
-    def _handle_for(self, lines: list, start: int, base_dir: Path, depth: int) -> tuple:
-        """Handle for loop: for var in 1..5 or for var in a b c."""
-        import re
-        
-        line = lines[start].strip()
-        match = re.match(r'^for\s+(\w+)\s+in\s+(.+)$', line, re.IGNORECASE)
+        line = lines[start][1]
+        match = _RE_FOR.match(line)
         
         if not match:
             print(f"Error: Invalid for syntax: {line}")
-            return [], start + 1
+            return start + 1
         
-        var_name = match.group(1)
-        values_str = match.group(2).strip()
+        end = table[start]
         
-        # Expand variables in range/list first
-        values_str = self._expand_variables(values_str)
+        # FOR binds the values, FOR_NEXT advances them; the body jumps back to FOR_NEXT
+        code.append(Instr(_OP_FOR, sys.intern(match.group(1)), match.group(2).strip()))
+        next_pc = len(code)
+        loop_next = Instr(_OP_FOR_NEXT)
+        code.append(loop_next)
+        self._compile_block(lines, table, start + 1, end, base_dir, code, depth + 1)
+        code.append(Instr(_OP_JUMP, next_pc))
+        loop_next.a = len(code)
         
-        # Parse values
-        values = []
-        
-        # Check for range: 1..5 or 1..10 step 2
-        range_match = re.match(r'^(\d+)\.\.(\d+)(?:\s+step\s+(\d+))?$', values_str)
-        if range_match:
-            start_val = int(range_match.group(1))
-            end_val = int(range_match.group(2))
-            step = int(range_match.group(3)) if range_match.group(3) else 1
-            values = list(range(start_val, end_val + 1, step))
-        else:
-            # List of values (split by space, respect quotes)
-            values = self._split_values(values_str)
-        
-        # Find matching endfor
-        block_lines, end_idx = self._find_block_end(lines, start + 1, 'endfor')
-        
-        # Expand block for each value
-        result = []
-        iteration = 0
-        
-        for val in values:
-            if iteration >= self.max_iterations:
-                print(f"Warning: For loop exceeded max iterations ({self.max_iterations})")
-                break
-            
-            old_val = self.variables.get(var_name)
-            self.variables[var_name] = val
-            
-            expanded = self._expand_block(block_lines, base_dir, depth + 1)
-            result.extend(expanded)
-            
-            if old_val is not None:
-                self.variables[var_name] = old_val
-            else:
-                del self.variables[var_name]
-            
-            iteration += 1
-        
-        return result, end_idx + 1
+        return end + 1
     
-    def _handle_while(self, lines: list, start: int, base_dir: Path, depth: int) -> tuple:
-        """Handle while loop: while condition."""
-        import re
+    def _compile_while(self, lines: list, table: dict, start: int,
+                       base_dir: Path, code: list, depth: int) -> int:
+        """Compile while loop: while condition."""
         
-        line = lines[start].strip()
-        match = re.match(r'^while\s+(.+)$', line, re.IGNORECASE)
+        line = lines[start][1]
+        match = _RE_WHILE.match(line)
         
         if not match:
             print(f"Error: Invalid while syntax: {line}")
-            return [], start + 1
+            return start + 1
         
-        condition = match.group(1).strip()
-        
-        # Find matching endwhile
-        block_lines, end_idx = self._find_block_end(lines, start + 1, 'endwhile')
-        
-        # Expand block while condition is true
-        result = []
-        iteration = 0
+        end = table[start]
         
-        while self._evaluate_condition(condition):
-            if iteration >= self.max_iterations:
-                print(f"Warning: While loop exceeded max iterations ({self.max_iterations})")
-                break
-            
-            expanded = self._expand_block(block_lines, base_dir, depth + 1)
-            result.extend(expanded)
-            iteration += 1
+        code.append(Instr(_OP_WHILE))
+        test_pc = len(code)
+        loop_test = Instr(_OP_WHILE_TEST, match.group(1).strip())
+        code.append(loop_test)
+        self._compile_block(lines, table, start + 1, end, base_dir, code, depth + 1)
+        code.append(Instr(_OP_JUMP, test_pc))
+        loop_test.b = len(code)
         
-        return result, end_idx + 1
+        return end + 1
     
-    def _handle_if(self, lines: list, start: int, base_dir: Path, depth: int) -> tuple:
-        """Handle if/else/endif."""
-        import re
+    def _compile_if(self, lines: list, table: dict, start: int,
+                    base_dir: Path, code: list, depth: int) -> int:
+        """Compile if/else/endif."""
         
-        line = lines[start].strip()
-        match = re.match(r'^if\s+(.+)$', line, re.IGNORECASE)
+        line = lines[start][1]
+        match = _RE_IF.match(line)
         
         if not match:
             print(f"Error: Invalid if syntax: {line}")
-            return [], start + 1
+            return start + 1
         
         condition = match.group(1).strip()
         
         # Find else and endif
-        if_lines = []
-        else_lines = []
-        end_idx = None
-        found_else = False
-        nested = 0
-        i = start + 1
-        
-        while i < len(lines):
-            lower = lines[i].strip().lower()
-            
-            if lower.startswith('if '):
-                nested += 1
-            elif lower == 'endif':
-                if nested == 0:
-                    end_idx = i
-                    break
-                nested -= 1
-            elif lower == 'else' and nested == 0:
-                found_else = True
-                i += 1
-                continue
-            
-            if found_else:
-                else_lines.append(lines[i])
-            else:
-                if_lines.append(lines[i])
-            
-            i += 1
-        
-        if end_idx is None:
-            print(f"Error: No matching endif for if at line {start + 1}")
-            return [], start + 1
-        
-        # Evaluate condition and expand appropriate block
-        if self._evaluate_condition(condition):
-            result = self._expand_block(if_lines, base_dir, depth + 1)
+        end = table[start]
+        else_idx = None
+        if lines[end][0] == _KIND_ELSE:
+            else_idx, end = end, table[end]
+        
+        branch = Instr(_OP_JUMP_IF_FALSE, condition)
+        code.append(branch)
+        self._compile_block(lines, table, start + 1, else_idx if else_idx is not None else end,
+                            base_dir, code, depth + 1)
+        if else_idx is not None:
+            skip_else = Instr(_OP_JUMP)
+            code.append(skip_else)
+            branch.b = len(code)
+            self._compile_block(lines, table, else_idx + 1, end, base_dir, code, depth + 1)
+            skip_else.a = len(code)
         else:
-            result = self._expand_block(else_lines, base_dir, depth + 1)
+            branch.b = len(code)
         
-        return result, end_idx + 1
+        return end + 1
     
-    def _handle_call(self, line: str, base_dir: Path, depth: int) -> list:
-        """Handle call subroutine."""
-        import re
+    def _compile_call(self, line: str, code: list):
+        """Compile call subroutine."""
         
-        match = re.match(r'^call\s+(\w+)(?:\s+(.*))?$', line, re.IGNORECASE)
+        match = _RE_CALL.match(line)
         if not match:
             print(f"Error: Invalid call syntax: {line}")
-            return []
-        
-        sub_name = match.group(1)
-        args_str = match.group(2) or ''
+            return
         
+        code.append(Instr(_OP_CALL, match.group(1), match.group(2) or ''))
+    
+    # ---- Runtime ----
+    
+    def _execute(self, code: list, depth: int = 0):
+        """Run compiled instructions, yielding parsed commands as they are reached."""
+        scopes = self._scopes
+        loops = []  # Active loop state, innermost last
+        pc = 0
+        end = len(code)
+        
+        while pc < end:
+            instr = code[pc]
+            op = instr.op
+            pc += 1
+            
+            if op == _OP_CMD:
+                parsed = instr.b
+                if parsed is None:
+                    parsed = self._parse_command(self._expand_variables(instr.a))
+                    if parsed is None:
+                        continue  # Line expanded to nothing
+                yield parsed
+            
+            elif op == _OP_SET:
+                value = self._evaluate_expression(instr.b)
+                self._set_variable(instr.a, value)
+                print(f"  [set {instr.a} = {value}]")
+            
+            elif op == _OP_JUMP:
+                pc = instr.a
+            
+            elif op == _OP_JUMP_IF_FALSE:
+                if not self._evaluate_condition(instr.a):
+                    pc = instr.b
+            
+            elif op == _OP_FOR:
+                # The loop variable lives in its own scope, dropped when the loop ends
+                scope = {}
+                scopes.append(scope)
+                # [var, scope, value iterator, iterations so far]
+                loops.append([instr.a, scope, iter(self._loop_values(instr.b)), 0])
+            
+            elif op == _OP_FOR_NEXT:
+                state = loops[-1]
+                val = next(state[2], _LOOP_DONE)
+                if val is not _LOOP_DONE and state[3] >= self.max_iterations:
+                    print(f"Warning: For loop exceeded max iterations ({self.max_iterations})")
+                    val = _LOOP_DONE
+                if val is _LOOP_DONE:
+                    loops.pop()
+                    scopes.pop()
+                    pc = instr.a
+                else:
+                    state[1][state[0]] = val
+                    state[3] += 1
+            
+            elif op == _OP_WHILE:
+                loops.append([0])
+            
+            elif op == _OP_WHILE_TEST:
+                state = loops[-1]
+                if not self._evaluate_condition(instr.a):
+                    loops.pop()
+                    pc = instr.b
+                elif state[0] >= self.max_iterations:
+                    print(f"Warning: While loop exceeded max iterations ({self.max_iterations})")
+                    loops.pop()
+                    pc = instr.b
+                else:
+                    state[0] += 1
+            
+            elif op == _OP_CALL:
+                yield from self._call(instr.a, instr.b, depth)
+            
+            elif op == _OP_INCLUDE:
+                yield from self._load_include(instr.a)
+    
+    def _call(self, sub_name: str, args_str: str, depth: int):
+        """Run a subroutine with $1, $2, ... bound to its arguments."""
         if sub_name not in self.subroutines:
             print(f"Error: Subroutine not found: {sub_name}")
-            return []
+            return
+        
+        if depth + 1 > 50:
+            print("Error: Maximum nesting depth exceeded")
+            return
         
-        # Parse arguments and set as $1, $2, etc.
+        # Parse arguments and bind them as $1, $2, etc. in the call's scope
         args = self._split_values(args_str)
-        old_args = {}
+        self._scopes.append({str(i): arg for i, arg in enumerate(args, 1)})
         
-        for i, arg in enumerate(args, 1):
-            old_args[str(i)] = self.variables.get(str(i))
-            self.variables[str(i)] = arg
+        yield from self._execute(self.subroutines[sub_name], depth + 1)
         
-        # Expand subroutine
-        result = self._expand_block(self.subroutines[sub_name], base_dir, depth + 1)
+        self._scopes.pop()
+    
+    def _get_variable(self, name: str, default=''):
+        """Look a variable up from the innermost scope outwards."""
+        for scope in reversed(self._scopes):
+            if name in scope:
+                return scope[name]
+        return default
+    
+    def _set_variable(self, name: str, value):
+        """Assign in the innermost scope that defines name, else as a global.
         
-        # Restore old args
-        for key, val in old_args.items():
-            if val is not None:
-                self.variables[key] = val
-            elif key in self.variables:
-                del self.variables[key]
+        A set on a loop variable or call argument therefore ends with its
+        loop or call, while any other set persists.
+        """
+        for scope in reversed(self._scopes):
+            if name in scope:
+                scope[name] = value
+                return
+        self.variables[name] = value
+    
+    def _load_include(self, include_path: str) -> tuple:
+        """Parsed commands of an included file, re-read only when its mtime changes."""
+        try:
+            mtime = os.path.getmtime(include_path)
+        except OSError:
+            print(f"Error: Include file not found: {include_path}")
+            return ()
         
-        return result
+        cached = self._include_cache.get(include_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        
+        commands = tuple(self._parse_command(cmd_str)
+                         for cmd_str in load_script_file(include_path))
+        self._include_cache[include_path] = (mtime, commands)
+        return commands
     
-    def _find_block_end(self, lines: list, start: int, end_keyword: str) -> tuple:
-        """Find the end of a block (endfor, endwhile, etc.)."""
-        block_lines = []
-        nested = 0
-        i = start
+    def _parse_command(self, cmd_str: str) -> tuple:
+        """Parse a command produced at run time, reporting the offending line."""
+        try:
+            return _parse_command_cached(cmd_str)
+        except ValueError as e:
+            print(f"Error parsing '{cmd_str}': {e}")
+            raise ScriptError(str(e)) from e
+    
+    def _loop_values(self, values_str: str):
+        """Resolve a for loop's values: a lazy range for 1..5 [step n], else a list of words."""
         
-        while i < len(lines):
-            lower = lines[i].strip().lower()
-            
-            # Check for nested blocks
-            if lower.startswith('for ') or lower.startswith('while ') or lower.startswith('if '):
-                nested += 1
-            elif lower in ('endfor', 'endwhile', 'endif'):
-                if nested == 0 and lower == end_keyword:
-                    return block_lines, i
-                nested -= 1
-            
-            block_lines.append(lines[i])
-            i += 1
+        # Expand variables in range/list first
+        values_str = self._expand_variables(values_str)
+        
+        # Check for range: 1..5 or 1..10 step 2
+        range_match = _RE_RANGE.match(values_str)
+        if range_match:
+            start_val = int(range_match.group(1))
+            end_val = int(range_match.group(2))
+            step = int(range_match.group(3)) if range_match.group(3) else 1
+            return range(start_val, end_val + 1, step)
+        
+        # List of values (split by space, respect quotes)
+        return self._split_values(values_str)
+    
+    def _evaluate_expression(self, expr: str):
+        """Evaluate an expression (math, variables, etc.)."""
+        
+        # Variables are arithmetic operands of the compiled expression when
+        # their values are plain numbers, so no text is expanded or rescanned
+        compiled = _compile_arith(expr)
+        if compiled is not None:
+            rpn, names = compiled
+            bindings = {}
+            get = self.variables.get if len(self._scopes) == 1 else self._get_variable
+            for name in names:
+                value = _plain_number(get(name, ''))
+                if value is None:
+                    break
+                bindings[name] = value
+            else:
+                try:
+                    return self._arith_result(_eval_rpn(rpn, bindings))
+                except ArithmeticError:
+                    pass
+        elif '$' not in expr:
+            return expr
+        
+        # Otherwise expand variables as text first
+        expr = self._expand_variables(expr)
+        
+        # Try simple arithmetic: number op number
+        try:
+            # Only plain arithmetic characters are considered
+            if _RE_SAFE_EXPR.match(expr):
+                compiled = _compile_arith(expr)
+                if compiled is not None:
+                    return self._arith_result(_eval_rpn(compiled[0]))
+        except ArithmeticError:
+            pass
         
-        print(f"Warning: No matching {end_keyword} found")
-        return block_lines, i
+        return expr
+    
+    @staticmethod
+    def _arith_result(result):
+        """Whole-valued float results become ints (7/7 -> 1)."""
+        if isinstance(result, float) and result == int(result):
+            return int(result)
+        return result
+    
+    def _expand_variables(self, line: str) -> str:
+        """Expand $var and ${var} references in a line."""
+        if '$' not in line:
+            return line
+        
+        head, refs = _var_template(line)
+        get = self.variables.get if len(self._scopes) == 1 else self._get_variable
+        out = [head]
+        for name, literal in refs:
+            out.append(str(get(name, '')))
+            out.append(literal)
+        return ''.join(out)
     
     def _evaluate_condition(self, condition: str) -> bool:
         """Evaluate a condition expression."""
-        import re
         
         # Expand variables first
         condition = self._expand_variables(condition)
         
         # Handle comparison operators
-        operators = ['==', '!=', '>=', '<=', '>', '<']
-        
-        for op in operators:
-            if op in condition:
-                parts = condition.split(op, 1)
-                if len(parts) == 2:
-                    left = self._evaluate_expression(parts[0].strip())
-                    right = self._evaluate_expression(parts[1].strip())
-                    
-                    # Convert to comparable types
-                    try:
-                        left = float(left) if '.' in str(left) or isinstance(left, (int, float)) else str(left)
-                        right = float(right) if '.' in str(right) or isinstance(right, (int, float)) else str(right)
-                    except:
-                        left = str(left)
-                        right = str(right)
-                    
-                    if op == '==':
-                        return left == right
-                    elif op == '!=':
-                        return left != right
-                    elif op == '>=':
-                        return left >= right
-                    elif op == '<=':
-                        return left <= right
-                    elif op == '>':
-                        return left > right
-                    elif op == '<':
-                        return left < right
+        split = _split_condition(condition)
+        if split is not None:
+            compare, left, right = split
+            left = self._evaluate_expression(left)
+            right = self._evaluate_expression(right)
+            
+            # Convert to comparable types
+            try:
+                left = float(left) if '.' in str(left) or isinstance(left, (int, float)) else str(left)
+                right = float(right) if '.' in str(right) or isinstance(right, (int, float)) else str(right)
+            except ValueError:
+                left = str(left)
+                right = str(right)
+            
+            try:
+                return compare(left, right)
+            except TypeError:
+                # A number against text (e.g. 5 > abc) compares as strings
+                return compare(str(left), str(right))
         
         # Treat non-empty string as true
         return bool(condition and condition.lower() not in ('false', '0', 'no', 'off'))
     
     def _split_values(self, s: str) -> list:
         """Split a string into values, respecting quotes."""
-        import shlex
+        # Whole quoted or bare words are tokenized directly; escapes, quotes
+        # glued to other text and unmatched quotes are left to shlex.
+        # Values are interned, so repeated words share one string object.
+        text = s.rstrip(' \t\r\n')
+        values = []
+        pos = 0
+        match = _RE_VALUE_TOKEN.match
+        while pos < len(text):
+            m = match(text, pos)
+            if m is None:
+                break
+            double, single, bare = m.groups()
+            values.append(sys.intern(double if double is not None else single if single is not None else bare))
+            pos = m.end()
+        else:
+            return values
+        
         try:
-            return shlex.split(s)
-        except:
-            return s.split()
+            tokens = shlex.split(s)
+        except ValueError:
+            tokens = s.split()
+        return [sys.intern(tok) for tok in tokens]
+
+
+def read_script_lines(filepath: Path):
+    """Read a script file into a list of lines, or None (after reporting) if it cannot be read."""
+    try:
+        with open(filepath, 'r') as f:
+            return [line.rstrip('\n\r') for line in f]
+    except Exception as e:
+        print(f"Error reading file {filepath}: {e}")
+        return None
 
 
 def load_script_file(filepath: Path, base_dir: Path = None, visited: set = None, interpreter: ScriptInterpreter = None) -> list:
@@ -2386,30 +3663,36 @@ def load_script_file(filepath: Path, base_dir: Path = None, visited: set = None,
         interpreter: ScriptInterpreter instance for preprocessing
     
     Returns:
-        List of command strings
+        List of parsed (cmd, args, opts) commands when an interpreter is
+        given, otherwise the list of raw command strings
+    
+    Raises:
+        ValueError: If the interpreter produces a command that cannot be parsed
     """
     if visited is None:
         visited = set()
     
+    # A path already seen as given is skipped without resolving it again
+    given = str(filepath)
+    if given in visited:
+        print(f"Warning: Skipping already included file: {filepath}")
+        return []
+    
     filepath = Path(filepath).resolve()
+    resolved = str(filepath)
     
-    if filepath in visited:
+    if resolved in visited:
         print(f"Warning: Skipping already included file: {filepath}")
         return []
     
-    visited.add(filepath)
+    visited.add(given)
+    visited.add(resolved)
     
     if base_dir is None:
         base_dir = filepath.parent
     
-    lines = []
-    
-    try:
-        with open(filepath, 'r') as f:
-            lines = [line.rstrip('\n\r') for line in f]
-    
-    except Exception as e:
-        print(f"Error reading file {filepath}: {e}")
+    lines = read_script_lines(filepath)
+    if lines is None:
         return []
     
     # Use interpreter for preprocessing if available
@@ -2428,7 +3711,6 @@ def load_script_file(filepath: Path, base_dir: Path = None, visited: set = None,
 
 def main():
     """CLI interface with multi-command support."""
-    import sys
     
     args = sys.argv[1:]
     
@@ -2436,8 +3718,11 @@ def main():
         CommandParser.print_help()
         return
     
+    # Commands that don't need a robot connection
+    offline_commands = {'list-anims', 'list-groups', 'list-sounds', 'help'}
+    
     # Check for file input
-    commands_raw = []
+    commands = []
     interpreter = None
     
     if args[0] in ('-s', '--script'):
@@ -2448,34 +3733,44 @@ def main():
         if not filepath.exists():
             print(f"Error: Script not found: {filepath}")
             return 1
-        interpreter = ScriptInterpreter()
-        commands_raw = load_script_file(filepath, interpreter=interpreter)
-        if not commands_raw:
+        lines = read_script_lines(filepath)
+        if lines is None:
             return 1
-    else:
-        commands_raw = args
-    
-    # Parse all commands first to catch errors early
-    commands = []
-    for cmd_str in commands_raw:
+        interpreter = ScriptInterpreter()
+        # Static parse errors are reported here, before connecting to the robot
         try:
-            parsed = CommandParser.parse_command(cmd_str)
-            commands.append(parsed)
-        except ValueError as e:
-            print(f"Error parsing '{cmd_str}': {e}")
+            code = interpreter.compile(lines, filepath.resolve().parent)
+        except ScriptError:
             return 1
-    
-    # Check if all commands are offline commands (don't need robot connection)
-    offline_commands = {'list-anims', 'list-groups', 'list-sounds', 'help'}
-    needs_connection = any(cmd[0] not in offline_commands for cmd in commands)
+        if not code:
+            return 1
+        # Scripts run as they execute; whether to connect is decided from the program
+        needs_connection = interpreter.needs_connection(code, offline_commands)
+        commands = interpreter.run(code)
+    else:
+        # Parse all commands first to catch errors early
+        for cmd_str in args:
+            try:
+                parsed = _parse_command_cached(cmd_str)
+            except ValueError as e:
+                print(f"Error parsing '{cmd_str}': {e}")
+                return 1
+            if parsed is not None:
+                commands.append(parsed)
+        
+        # Check if all commands are offline commands (don't need robot connection)
+        needs_connection = any(cmd[0] not in offline_commands for cmd in commands)
     
     if not needs_connection:
         # Don't connect to robot for offline commands
         controller = CozmoController(auto_connect=False)
         
         # Execute commands
-        for cmd, args, opts in commands:
-            execute_command(controller, cmd, args, opts)
+        try:
+            for cmd, args, opts in commands:
+                execute_command(controller, cmd, args, opts)
+        except ScriptError:
+            return 1
         return 0
     
     # Connect to robot for commands that need it
@@ -2490,24 +3785,29 @@ def main():
     print("=" * 60)
     
     # Execute commands in sequence
+    interrupted = False
+    script_failed = False
     try:
         for cmd, args, opts in commands:
             success = execute_command(controller, cmd, args, opts)
             if not success:
                 print(f"  Command failed: {cmd}")
     except KeyboardInterrupt:
+        interrupted = True
         print("\n\nInterrupted by user")
+    except ScriptError:
+        script_failed = True
+        print("  Script stopped")
     except Exception as e:
         print(f"\nError: {e}")
-        import traceback
         traceback.print_exc()
     finally:
         print("=" * 60)
         print("Disconnecting...")
-        controller.disconnect()
+        controller.disconnect(wait=not interrupted)
     
-    return 0
+    return 1 if script_failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
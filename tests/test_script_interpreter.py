@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Tests for the script interpreter (compile and run of script files)."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cozmo_controller import ScriptInterpreter, ScriptError
+
+
+def run_script(text):
+    """Compile and run a script, returning the (cmd, args) of each command produced."""
+    interpreter = ScriptInterpreter()
+    code = interpreter.compile(text.strip().splitlines())
+    return [(cmd, list(args)) for cmd, args, opts in interpreter.run(code)]
+
+
+class TestCompileErrors(unittest.TestCase):
+
+    def test_static_parse_error_raised_at_compile(self):
+        interpreter = ScriptInterpreter()
+        with self.assertRaises(ScriptError):
+            interpreter.compile(["say hello", "bogus-cmd 1"])
+
+    def test_variable_line_parsed_at_run_time(self):
+        interpreter = ScriptInterpreter()
+        code = interpreter.compile(["say hello", "set c bogus-cmd", "$c 1"])
+        commands = interpreter.run(code)
+        self.assertEqual(next(commands)[0], 'say')
+        with self.assertRaises(ScriptError):
+            next(commands)
+
+    def test_missing_endif_inside_for_rejected(self):
+        with self.assertRaises(ScriptError):
+            run_script("for i in 1..2\nif 1\nsay a $i\nendfor\nsay after")
+
+    def test_unclosed_block_rejected(self):
+        with self.assertRaises(ScriptError):
+            run_script("for i in 1..2\nfor j in 1..2\nsay $i $j\nendfor")
+
+    def test_enddef_inside_open_block_rejected(self):
+        with self.assertRaises(ScriptError):
+            run_script("def f\nfor i in 1..2\nsay $i\nenddef\ncall f")
+
+    def test_balanced_blocks(self):
+        self.assertEqual(
+            run_script("for i in 1..2\nif $i == 2\nsay two\nelse\nsay one\nendif\nendfor"),
+            [('say', ['one']), ('say', ['two'])])
+
+    def test_stray_closer_is_skipped(self):
+        self.assertEqual(run_script("say a\nendif\nsay b"), [('say', ['a']), ('say', ['b'])])
+
+
+class TestConditions(unittest.TestCase):
+
+    def run_if(self, condition, setup=""):
+        return run_script(f"{setup}\nif {condition}\nsay yes\nelse\nsay no\nendif")
+
+    def test_mixed_operators_split_by_priority(self):
+        # Splits at '==' (highest priority), comparing "3 > 2" with 1
+        self.assertEqual(self.run_if("$a > 2 == 1", "set a 3"), [('say', ['no'])])
+
+    def test_number_against_text_compares_as_strings(self):
+        self.assertEqual(self.run_if("5 > abc"), [('say', ['no'])])
+
+    def test_two_character_operator(self):
+        self.assertEqual(self.run_if("$a >= 3", "set a 3"), [('say', ['yes'])])
+
+
+if __name__ == '__main__':
+    unittest.main()